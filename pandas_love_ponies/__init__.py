@@ -1,5 +1,11 @@
-from core import to_django
-from core import validate_for_django
-from core import PandasLovesPoniesException
+from .core import to_django
+from .core import to_django_many
+from .core import validate_for_django
+from .core import ato_django
+from .core import read_django
+from .core import PandasLovesPoniesException
+from .core import LoadStats
+from .core import log_stats
+from .core import clear_fk_cache
 
 __version__ = "0.7.2"
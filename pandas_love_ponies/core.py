@@ -1,11 +1,185 @@
+import contextlib
+import decimal
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import numpy as np
 import pandas as pd
 import pytz
 
+from collections import OrderedDict
+from collections import namedtuple
+from itertools import islice
+from itertools import repeat
+from timeit import default_timer
+
+logger = logging.getLogger(__name__)
+
 
 class PandasLovesPoniesException(Exception):
     pass
 
 
+class LoadStats(object):
+    """
+    Statistics of a to_django() load, filled in as it goes.
+
+    Attributes
+    ----------
+    phases: dict of phase name to seconds spent in it, summed over chunks
+        (and threads, with workers). 'validate', 'prepare' (reading columns
+        out of the DataFrame), 'fetch' (looking up existing records), 'build'
+        (creating model instances) and 'write'.
+    rows: number of rows processed.
+    chunks: number of chunks flushed.
+    queries: number of queries run, an executemany counts as one.
+    bytes_sent: approximate size of the SQL and parameters sent.
+    duplicates: number of rows collapsed by on_duplicate.
+    batch_sizes: with bulk_create_size='auto', the size of each batch.
+    seconds: wall time of the whole load.
+    progress: callable, called with this object after each chunk.
+    """
+    def __init__(self, progress=None):
+        self.phases = OrderedDict((name, 0.0) for name in
+                                  ('validate', 'prepare', 'fetch', 'build',
+                                   'write'))
+        self.rows = 0
+        self.chunks = 0
+        self.queries = 0
+        self.bytes_sent = 0
+        self.duplicates = 0
+        self.batch_sizes = []
+        self.seconds = 0.0
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager, adding the time spent within to the phase.
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            elapsed = default_timer() - start
+            with self._lock:
+                self.phases[name] += elapsed
+
+    def add_chunk(self, rows):
+        """
+        Record a chunk of rows was flushed, and report progress.
+        """
+        with self._lock:
+            self.rows += rows
+            self.chunks += 1
+        if self.progress is not None:
+            self.progress(self)
+
+    def add_duplicates(self, rows):
+        """
+        Record rows were collapsed as duplicates.
+        """
+        with self._lock:
+            self.duplicates += rows
+
+    def counting(self, connection):
+        """
+        Context manager, counting queries run on the Django connection.
+        """
+        return connection.execute_wrapper(self._count_query)
+
+    def _count_query(self, execute, sql, params, many, context):
+        size = len(sql)
+        # don't consume iterators of params, they're only read once.
+        if isinstance(params, (list, tuple, dict)):
+            for row in (params if many else [params]):
+                if isinstance(row, dict):
+                    row = row.values()
+                size += sum(len(x) if isinstance(x, (str, bytes)) else 8
+                            for x in row)
+        with self._lock:
+            self.queries += 1
+            self.bytes_sent += size
+        return execute(sql, params, many, context)
+
+    def merge(self, other):
+        """
+        Add in the counts and timings of another LoadStats, e.g. one filled
+        in by a worker process, and report progress.
+        """
+        with self._lock:
+            for name, seconds in other.phases.items():
+                self.phases[name] += seconds
+            self.rows += other.rows
+            self.chunks += other.chunks
+            self.queries += other.queries
+            self.bytes_sent += other.bytes_sent
+            self.duplicates += other.duplicates
+            self.batch_sizes.extend(other.batch_sizes)
+        if self.progress is not None:
+            self.progress(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['progress'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        return OrderedDict([
+            ('rows', self.rows),
+            ('chunks', self.chunks),
+            ('queries', self.queries),
+            ('bytes_sent', self.bytes_sent),
+            ('duplicates', self.duplicates),
+            ('seconds', self.seconds),
+            ('phases', OrderedDict(self.phases)),
+        ])
+
+    def __repr__(self):
+        return 'LoadStats(%s)' % ', '.join(
+            '%s=%r' % item for item in self.as_dict().items())
+
+
+class _NoStats(object):
+    """
+    Stand-in for LoadStats when not collecting statistics, does nothing.
+    """
+    _null_context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null_context
+
+    def add_chunk(self, rows):
+        pass
+
+    def add_duplicates(self, rows):
+        pass
+
+    def counting(self, connection):
+        return self._null_context
+
+_no_stats = _NoStats()
+
+
+def log_stats(stats):
+    """
+    Log a LoadStats at INFO level, can be passed as to_django(stats=...).
+    """
+    logger.info('to_django: %d rows in %d chunks, %.3fs (%s), %d queries, '
+                '%d bytes sent', stats.rows, stats.chunks, stats.seconds,
+                ', '.join('%s %.3fs' % item for item in stats.phases.items()),
+                stats.queries, stats.bytes_sent)
+
+
 def _has_default(field):
     """
     Does the field have the default attribute set.
@@ -15,6 +189,86 @@ def _has_default(field):
                   (field.default is not fields.NOT_PROVIDED))
     return has_default
 
+
+class ModelPlan(object):
+    """
+    What's needed to validate and write DataFrames to a Django model.
+
+    Worked out once per model class, use _model_plan() to get it.
+    """
+    def __init__(self, model):
+        from django.db.models import fields
+        self.model = model
+        # all fields bar 'id', in the model's order.
+        self.fields = [x for x in model._meta.fields if x.name != 'id']
+        self.has_default = {x.name: _has_default(x) for x in self.fields}
+        self.nonnull_fields = [x for x in self.fields if not x.null]
+        self.date_fields = [x.name for x in self.fields
+                            if isinstance(x, fields.DateField)]
+        self.datetime_fields = [x.name for x in self.fields
+                                if isinstance(x, fields.DateTimeField)]
+        self.char_fields = [x.name for x in self.fields
+                            if isinstance(x, fields.CharField)]
+        self.max_lengths = {x.name: x.max_length for x in self.fields
+                            if isinstance(x, fields.CharField)}
+        self.choices = {x.name: [key for key, _ in x.flatchoices]
+                        for x in self.fields if x.choices}
+        # internal type of the integer fields, e.g. 'SmallIntegerField'.
+        self.integer_fields = {
+            x.name: x.get_internal_type() for x in self.fields
+            if isinstance(x, fields.IntegerField) and not x.is_relation}
+        self.numeric_fields = [
+            x.name for x in self.fields
+            if isinstance(x, (fields.IntegerField, fields.FloatField,
+                              fields.DecimalField)) and not x.is_relation]
+        self.key_fields = _update_key_fields(model)
+        self.insert_fields = [x for x in model._meta.concrete_fields
+                              if not isinstance(x, fields.AutoField)]
+        self._insert_sql = {}
+
+    def insert_sql(self, connection):
+        """
+        INSERT statement for all of insert_fields, compiled once per database.
+        """
+        if connection.alias not in self._insert_sql:
+            quote_name = connection.ops.quote_name
+            sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote_name(self.model._meta.db_table),
+                ', '.join(quote_name(x.column) for x in self.insert_fields),
+                ', '.join(['%s'] * len(self.insert_fields)),
+            )
+            self._insert_sql[connection.alias] = sql
+        return self._insert_sql[connection.alias]
+
+
+def _model_plan(model):
+    """
+    Cached ModelPlan for the model.
+
+    Plans are dropped when a model class of the same name is (re)defined.
+    """
+    from django.db.models.signals import class_prepared
+    try:
+        return _model_plans[model]
+    except KeyError:
+        class_prepared.connect(_clear_model_plans,
+                               dispatch_uid='pandas_love_ponies')
+        plan = _model_plans[model] = ModelPlan(model)
+        return plan
+
+_model_plans = {}
+
+
+def _clear_model_plans(sender, **kwargs):
+    """
+    Drop the cached plans of models with the same label as sender.
+    """
+    label = sender._meta.label_lower
+    for model in list(_model_plans):
+        if model._meta.label_lower == label:
+            del _model_plans[model]
+
+
 def _column_getter(df, col):
     """
     Handles getting columns, whether they be true columns, or in index.
@@ -28,55 +282,675 @@ def _column_getter(df, col):
         except AttributeError:
             # non-multi-index
             values = df.index.values
-        return pd.Series(values)
+        return pd.Series(values, index=df.index, name=col)
+
+
+def _relevant_fields(df, model):
+    """
+    Fields of the Django model that are also in the DataFrame.
+
+    Looks at both the columns and the names of the index.
+    """
+    return [field for field in _model_plan(model).fields
+            if field.name in df or field.name in df.index.names]
+
+
+def _column_values(series, field, plan):
+    """
+    Convert a column into a list of python values for the Django field.
+
+    NaN's are handled for the whole column at once, by setting to None if the
+    field is nullable, or else using the field's default. CharFields without
+    a default get the empty string.
+
+    Categorical columns are converted a category at a time, and the values
+    taken by code, so each distinct value is one shared python object.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = pd.Series(series.cat.categories)
+        # the value for missing rows goes last, for code -1.
+        values = _column_values(categories, field, plan) + _column_values(
+            pd.Series([None], dtype=object), field, plan)
+        return np.array(values, dtype=object)[series.cat.codes.values].tolist()
+    if field.null:
+        values = _python_values(series, field, plan)
+        isnull = series.isnull().values
+        if isnull.any():
+            values = [None if missing else value
+                      for value, missing in zip(values, isnull)]
+        return values
+    elif plan.has_default[field.name]:
+        if series.hasnans:
+            series = series.fillna(field.default)
+        return _python_values(series, field, plan)
+    elif field.name in plan.char_fields:
+        if series.hasnans:
+            series = series.fillna('')
+        return series.tolist()
+    else:
+        return _python_values(series, field, plan)
+
+
+def _python_values(series, field, plan):
+    """
+    Convert a column's NumPy values to the python types the Django field's
+    database adapter takes, for the whole column at once.
+
+    datetime64 columns become datetimes (or dates for a DateField) rather
+    than Timestamps, timedelta64 columns timedeltas, and float columns for
+    integer fields (made float by NaN's) ints. Missing values are left as
+    NaN/NaT, for _column_values() to deal with.
+    """
+    kind = series.dtype.kind
+    if kind == 'M':
+        if field.name in plan.datetime_fields:
+            return pd.DatetimeIndex(series).to_pydatetime().tolist()
+        elif field.name in plan.date_fields:
+            return series.dt.date.tolist()
+    if kind == 'm':
+        return pd.TimedeltaIndex(series).to_pytimedelta().tolist()
+    elif kind == 'f' and field.name in plan.integer_fields:
+        isnull = series.isnull().values
+        if not isnull.any():
+            return series.astype(np.int64).tolist()
+        values = series.fillna(0).astype(np.int64).tolist()
+        return [np.nan if missing else value
+                for value, missing in zip(values, isnull)]
+    return series.tolist()
+
+
+def _utc_to_tz(series, tz, keep_tzinfo=False):
+    """
+    Convert a series of datetimes from UTC to the timezone tz.
+
+    Converts the whole column at once when it can be made datetime64, else
+    converts each value. Naive datetimes are assumed to be UTC, results are
+    made naive unless keep_tzinfo.
+    """
+    try:
+        series = pd.to_datetime(series)
+    except (ValueError, TypeError, OverflowError):
+        # e.g. dates out of range for datetime64, so do it a value at a time.
+        def localize_datetime(x):
+            if pd.isnull(x):
+                return None
+            if x.tzinfo is None:
+                x = pytz.utc.localize(x)
+            d = x.astimezone(pytz.timezone(tz))
+            if keep_tzinfo:
+                return d
+            # make naive.
+            return d.replace(tzinfo=None)
+        return series.map(localize_datetime)
+    if series.dt.tz is None:
+        series = series.dt.tz_localize('UTC')
+    series = series.dt.tz_convert(tz)
+    if not keep_tzinfo:
+        # make naive.
+        series = series.dt.tz_localize(None)
+    return series
+
+
+def _resolve_foreign_keys(series, field, lookup, create, chunk_size):
+    """
+    Map a series of natural keys to ids of the ForeignKey's related model.
+
+    Keys not in the cache are fetched with one IN query per chunk_size keys.
+    When create, missing related records are bulk created. Fetched ids are
+    only cached once the transaction commits, as a rollback may remove the
+    records they refer to.
+    """
+    from django.db import router, transaction
+    related = field.related_model
+    manager = related._default_manager
+    target = field.target_field.attname
+    mapping = {}
+    missing = []
+    for key in series.dropna().unique().tolist():
+        cache_key = (related, lookup, key)
+        if cache_key in _fk_cache:
+            _fk_cache.move_to_end(cache_key)
+            mapping[key] = _fk_cache[cache_key]
+        else:
+            missing.append(key)
+
+    def fetch(keys):
+        for chunk in _chunks(keys, chunk_size):
+            lookups = {'%s__in' % lookup: chunk}
+            for key, pk in manager.filter(**lookups).values_list(lookup,
+                                                                 target):
+                mapping[key] = pk
+
+    fetch(missing)
+    not_found = [key for key in missing if key not in mapping]
+    if not_found and create:
+        manager.bulk_create([related(**{lookup: key}) for key in not_found],
+                            batch_size=chunk_size)
+        # not all databases return ids from bulk_create, so fetch them.
+        fetch(not_found)
+        not_found = [key for key in not_found if key not in mapping]
+    if not_found:
+        error_msg = '%s: %d %s %s values not found, e.g. %r' % (
+            field.name, len(not_found), related.__name__, lookup,
+            not_found[0])
+        raise PandasLovesPoniesException(error_msg)
+    fetched = [(key, mapping[key]) for key in missing]
+
+    def cache():
+        for key, pk in fetched:
+            _cache_foreign_key((related, lookup, key), pk)
+    # runs straight away when not in a transaction.
+    transaction.on_commit(cache, using=router.db_for_write(related))
+    return series.map(mapping)
+
+
+def _cache_foreign_key(cache_key, pk):
+    _fk_cache[cache_key] = pk
+    _fk_cache.move_to_end(cache_key)
+    if len(_fk_cache) > _fk_cache_size:
+        _fk_cache.popitem(last=False)
+
+# LRU cache of (related model, lookup field, key) to id.
+_fk_cache = OrderedDict()
+_fk_cache_size = 100000
+
+
+def clear_fk_cache():
+    """
+    Empty the cache of natural keys to ids used for to_django(fk_lookups=...).
+
+    Needed if related records are deleted, or their keys changed.
+    """
+    _fk_cache.clear()
+
+
+def _chunks(iterable, size):
+    """
+    Split iterable up into lists of length size (the last may be shorter).
+
+    size can also be a callable, called for the length of each list.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size() if callable(size) else size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# memory allowed for a batch of model instances with bulk_create_size='auto',
+# and a rough size of an instance, bar its values.
+_auto_memory = 64 * 2 ** 20
+_instance_bytes = 1000
+
+
+class _AutoBatchSize(object):
+    """
+    Batch size for bulk_create_size='auto', tuned to the measured throughput.
+
+    Starts at the most rows the backend takes in one INSERT of the model (as
+    connection.ops.bulk_batch_size), within the memory cap. Then after each
+    batch, keeps moving the size the same way while rows/sec improves, and
+    turns back with a smaller step when it drops.
+    """
+    minimum = 10
+
+    def __init__(self, model):
+        from django.db import connections, router
+        connection = connections[router.db_for_write(model)]
+        fields = _model_plan(model).insert_fields
+        self.maximum = _auto_memory // (_instance_bytes + 100 * len(fields))
+        self.size = max(min(connection.ops.bulk_batch_size(
+            fields, range(self.maximum)), self.maximum), self.minimum)
+        self.sizes = []
+        self.rate = None
+        self.growing = True
+        self.factor = 2.0
+        self._lock = threading.Lock()
 
+    def fit(self, df):
+        """
+        Work out the memory cap in rows from the DataFrame's values.
+        """
+        sample = df.iloc[:1000]
+        if len(sample):
+            row_bytes = (sample.memory_usage(deep=True).sum() / len(sample) +
+                         _instance_bytes)
+            self.maximum = max(int(_auto_memory // row_bytes), self.minimum)
+            self.size = min(self.size, self.maximum)
 
-def validate_for_django(self, model):
+    def observe(self, rows, seconds):
+        """
+        Record a batch of rows took seconds, and pick the next size.
+        """
+        with self._lock:
+            self.sizes.append(rows)
+            if rows < self.size or seconds <= 0:
+                # e.g. the last batch, too short to say anything.
+                return
+            rate = rows / seconds
+            if self.rate is not None and rate < self.rate:
+                self.growing = not self.growing
+                self.factor = max(1 + (self.factor - 1) / 2, 1.1)
+            self.rate = rate
+            if self.growing:
+                size = self.size * self.factor
+            else:
+                size = self.size / self.factor
+            self.size = int(min(max(size, self.minimum), self.maximum))
+
+
+def _db_params(fields, names, columns, length, connection):
+    """
+    Prepare the columns for the database, one list of values per field.
+
+    Fields not in names get their default, a callable default (e.g.
+    uuid.uuid4) is called for each row.
+    """
+    params = []
+    for field in fields:
+        if field.name in names:
+            values = columns[names.index(field.name)]
+            params.append([field.get_db_prep_value(value, connection)
+                           for value in values])
+        elif field.has_default() and callable(field.default):
+            params.append([field.get_db_prep_value(field.get_default(),
+                                                   connection)
+                           for _ in range(length)])
+        else:
+            default = field.get_db_prep_value(field.get_default(), connection)
+            params.append(repeat(default, length))
+    return params
+
+
+def _raw_insert(model, names, columns, length, chunk_size, stats):
+    """
+    Insert the columns with cursor.executemany(), bypassing model instances.
+
+    Values are prepared for the database a column at a time, fields not in
+    names get their default.
+    """
+    from django.db import connections, router, transaction
+    connection = connections[router.db_for_write(model)]
+    plan = _model_plan(model)
+    sql = plan.insert_sql(connection)
+    with stats.phase('prepare'):
+        params = _db_params(plan.insert_fields, names, columns, length,
+                            connection)
+    rows = zip(*params)
+    for chunk in _chunks(rows, chunk_size):
+        with stats.phase('write'):
+            with transaction.atomic(using=connection.alias, savepoint=False):
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, chunk)
+        stats.add_chunk(len(chunk))
+
+
+def _merge_via_staging(model, names, columns, key_names, update_names, length,
+                       chunk_size, stats):
+    """
+    Merge the columns into the model's table through a temporary table.
+
+    The columns are loaded into the staging table with executemany(), then
+    existing records are updated with one UPDATE joined on the keys, and new
+    records inserted with one INSERT ... SELECT, all in one transaction.
+    Fields not in names get their default for new records.
+    """
+    from django.db import connections, router, transaction
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    plan = _model_plan(model)
+    staging_fields = list(plan.insert_fields)
+    pk = model._meta.pk
+    if pk.name in key_names and pk not in staging_fields:
+        staging_fields.insert(0, pk)
+    with stats.phase('prepare'):
+        params = _db_params(staging_fields, names, columns, length,
+                            connection)
+    table = quote_name(model._meta.db_table)
+    staging = quote_name('plp_staging_%s' % model._meta.db_table)
+    column_list = ', '.join(quote_name(x.column) for x in staging_fields)
+    keys = [quote_name(model._meta.get_field(x).column) for x in key_names]
+    updates = [quote_name(model._meta.get_field(x).column)
+               for x in update_names]
+    join = ' AND '.join('%s.%s = %s.%s' % (table, key, staging, key)
+                        for key in keys)
+    load_sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        staging, column_list, ', '.join(['%s'] * len(staging_fields)))
+    insert_sql = ('INSERT INTO %s (%s) SELECT %s FROM %s WHERE NOT EXISTS '
+                  '(SELECT 1 FROM %s WHERE %s)' % (
+                      table, column_list, column_list, staging, table, join))
+    with transaction.atomic(using=connection.alias, savepoint=False):
+        with connection.cursor() as cursor:
+            with stats.phase('write'):
+                cursor.execute(_drop_staging_sql(connection, staging,
+                                                 if_exists=True))
+                # same column types as the model's table, and no rows.
+                cursor.execute('CREATE TEMPORARY TABLE %s AS SELECT %s FROM '
+                               '%s WHERE 1 = 0' % (staging, column_list,
+                                                   table))
+            for chunk in _chunks(zip(*params), chunk_size):
+                with stats.phase('write'):
+                    cursor.executemany(load_sql, chunk)
+                stats.add_chunk(len(chunk))
+            with stats.phase('write'):
+                if updates:
+                    cursor.execute(_merge_update_sql(connection, table,
+                                                     staging, join, updates))
+                cursor.execute(insert_sql)
+                cursor.execute(_drop_staging_sql(connection, staging))
+
+
+def _drop_staging_sql(connection, staging, if_exists=False):
+    """
+    SQL to drop the temporary staging table, and never a table of the
+    database with the same name.
+
+    MySQL's DROP TEMPORARY TABLE doesn't commit the transaction as DROP TABLE
+    does, PostgreSQL and SQLite are pointed at their temporary schema.
+    """
+    if connection.vendor == 'mysql':
+        drop = 'DROP TEMPORARY TABLE'
+    else:
+        drop = 'DROP TABLE'
+    if if_exists:
+        drop += ' IF EXISTS'
+    schema = {'postgresql': 'pg_temp.', 'sqlite': 'temp.'}.get(
+        connection.vendor, '')
+    return '%s %s%s' % (drop, schema, staging)
+
+
+def _merge_update_sql(connection, table, staging, join, updates):
+    """
+    SQL to update the table's records from the staging table's rows.
+
+    Uses the backend's UPDATE join syntax, where it has one, else correlated
+    subqueries.
+    """
+    if connection.vendor == 'mysql':
+        return 'UPDATE %s JOIN %s ON %s SET %s' % (
+            table, staging, join, ', '.join('%s.%s = %s.%s' % (
+                table, column, staging, column) for column in updates))
+    if connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite' and
+            connection.Database.sqlite_version_info >= (3, 33, 0)):
+        return 'UPDATE %s SET %s FROM %s WHERE %s' % (
+            table, ', '.join('%s = %s.%s' % (column, staging, column)
+                             for column in updates), staging, join)
+    return 'UPDATE %s SET %s WHERE EXISTS (SELECT 1 FROM %s WHERE %s)' % (
+        table, ', '.join('%s = (SELECT %s.%s FROM %s WHERE %s)' % (
+            column, staging, column, staging, join) for column in updates),
+        staging, join)
+
+
+def _update_key_fields(model):
+    """
+    Fields used to look up existing records of the model.
+
+    The model's first Meta.unique_together, else its primary key.
+    """
+    try:
+        unique_togethers = model._meta.unique_together[0]
+    except IndexError:
+        return [model._meta.pk]
+    return [model._meta.get_field(name) for name in unique_togethers]
+
+
+def _fetch_existing(model, key_fields, keys):
+    """
+    Fetch existing records for the given key tuples.
+
+    A single key field is looked up with one IN query, several with an OR of
+    the key tuples, in as few queries as the backend's parameter limit
+    allows, so only records with one of the keys are fetched. Returns a dict
+    of key tuple to model instance.
+    """
+    from django.db import connections, router
+    from django.db.models import Q
+    keys = set(key for key in keys
+               if not any(pd.isnull(value) for value in key))
+    existing = {}
+    if not keys:
+        return existing
+    if len(key_fields) == 1:
+        querysets = [model.objects.filter(**{
+            '%s__in' % key_fields[0].attname: [key[0] for key in keys]})]
+    else:
+        connection = connections[router.db_for_read(model)]
+        batch_size = max(connection.ops.bulk_batch_size(key_fields,
+                                                        list(keys)), 1)
+        querysets = []
+        for batch in _chunks(keys, batch_size):
+            condition = Q()
+            for key in batch:
+                condition |= Q(**{field.attname: value for field, value
+                                  in zip(key_fields, key)})
+            querysets.append(model.objects.filter(condition))
+    for queryset in querysets:
+        for obj in queryset:
+            key = tuple(getattr(obj, field.attname) for field in key_fields)
+            existing[key] = obj
+    return existing
+
+
+def _update_objects(model, attnames, key_fields, chunk, stats):
+    """
+    Match a chunk of (values, key) rows against existing records.
+
+    Returns lists of (new objects, existing objects, object for each row).
+    Repeated keys within the chunk update the same object.
+    """
+    with stats.phase('fetch'):
+        keyed_objs = _fetch_existing(model, key_fields,
+                                     [key for _, key in chunk])
+    existing_objs = []
+    new_objs = []
+    objs = []
+    seen = set()
+    for values, key in chunk:
+        obj = keyed_objs.get(key)
+        if obj is None:
+            obj = model(**dict(zip(attnames, values)))
+            keyed_objs[key] = obj
+            new_objs.append(obj)
+            seen.add(key)
+        else:
+            for attname, value in zip(attnames, values):
+                setattr(obj, attname, value)
+            if key not in seen:
+                # only records a row refers to are updated, once each.
+                existing_objs.append(obj)
+                seen.add(key)
+        objs.append(obj)
+    return new_objs, existing_objs, objs
+
+
+def validate_for_django(self, model, report=False):
     """
     Validate the dataframe is valid to be written to the Django model.
+
+    Every row of the relevant columns is checked, column at a time, for:
+    missing columns, nulls where the field doesn't allow them (and has no
+    default), dates that are strings, values that aren't numbers for numeric
+    fields (or aren't whole numbers for integer fields), integers out of
+    range for the database, strings longer than max_length, and values not
+    in the field's choices.
+
+    Parameters
+    ----------
+    model : Django model
+        Model the DataFrame is to be written to.
+    report: boolean, default False
+        When True, don't raise, return the problems found, as a dict of
+        (column, rule) to the index of the offending rows (empty for missing
+        columns). Rules are 'missing_column', 'null', 'date_strings',
+        'dtype', 'overflow', 'max_length' and 'choices'.
     """
     if len(self) == 0:
-        return True
-    _test_no_missing_columns(self, model)
-    _test_dates_arent_strings(self, model)
-    _test_invalid_nulls(self, model)
+        return OrderedDict() if report else True
+    problems = _validation_problems(self, model)
+    if report:
+        return problems
+    if problems:
+        error_msg = '; '.join(
+            (_rule_messages[rule] % column) +
+            ('' if rule == 'missing_column' else ' (%d rows)' % len(rows))
+            for (column, rule), rows in problems.items())
+        raise PandasLovesPoniesException(error_msg)
     return True
 
 
-def _test_no_missing_columns(self, model):
+_rule_messages = {
+    'missing_column': 'missing column: %s',
+    'null': '%s column contains nulls',
+    'date_strings': 'date column %s is strings',
+    'dtype': '%s column has values of the wrong type',
+    'overflow': '%s column has values out of range',
+    'max_length': '%s column has strings longer than max_length',
+    'choices': '%s column has values not in choices',
+}
+
+
+def _validation_problems(self, model):
     """
-    Are there any necessary columns, that don't exist in the dataframe?
+    Run all the validation rules, see validate_for_django().
     """
-    obj = model()
-    for field in obj._meta.fields:
-        if field.name == 'id':
-            continue
-        if _has_default(field):
+    from django.db import connections, router
+    plan = _model_plan(model)
+    connection = connections[router.db_for_write(model)]
+    problems = OrderedDict()
+    # numeric columns are converted once, for both of their rules.
+    dtype_rows, overflow_rows = _numeric_problem_rows(self, plan, connection)
+    for rule, rule_rows in [
+            ('missing_column', _missing_column_rows(self, plan, connection)),
+            ('null', _null_rows(self, plan, connection)),
+            ('date_strings', _date_string_rows(self, plan, connection)),
+            ('dtype', dtype_rows),
+            ('overflow', overflow_rows),
+            ('max_length', _max_length_rows(self, plan, connection)),
+            ('choices', _choices_rows(self, plan, connection))]:
+        for column, rows in rule_rows:
+            problems[(column, rule)] = rows
+    return problems
+
+
+def _columns(self, names):
+    """
+    (name, series) for each of the names that is a column or in the index.
+    """
+    for name in names:
+        series = _column_getter(self, name)
+        if series is not None:
+            yield name, series
+
+
+def _missing_column_rows(self, plan, connection):
+    for field in plan.fields:
+        if plan.has_default[field.name]:
             continue
         if field.name not in self and field.name not in self.index.names:
-            raise PandasLovesPoniesException('missing column: %s' % field.name)
+            yield field.name, self.index[:0]
+
+
+def _null_rows(self, plan, connection):
+    names = [x.name for x in plan.nonnull_fields
+             if not plan.has_default[x.name]]
+    for name, series in _columns(self, names):
+        isnull = series.isnull()
+        if isnull.any():
+            yield name, series.index[isnull.values]
+
+
+def _date_string_rows(self, plan, connection):
+    for name, series in _columns(self, plan.date_fields):
+        if series.dtype != object:
+            continue
+        # NaN isn't a str, so needs no special handling.
+        is_string = series.map(_is_string).astype(bool)
+        if is_string.any():
+            yield name, series.index[is_string.values]
+
+
+def _is_string(value):
+    return isinstance(value, str)
+
+
+def _numeric_problem_rows(self, plan, connection):
+    """
+    Lists of (name, rows) for the dtype and overflow rules.
+
+    Both come from one pd.to_numeric() of each numeric field's column.
+    """
+    dtype_rows = []
+    overflow_rows = []
+    for name, series in _columns(self, plan.numeric_fields):
+        if series.dtype == bool:
+            series = series.astype(int)
+        numeric = pd.to_numeric(series, errors='coerce')
+        not_number = numeric.isnull() & series.notnull()
+        if name in plan.integer_fields:
+            not_number |= numeric.notnull() & (numeric % 1 != 0)
+        if not_number.any():
+            dtype_rows.append((name, series.index[not_number.values]))
+        if name not in plan.integer_fields:
+            continue
+        low, high = _integer_range(plan.integer_fields[name], connection)
+        overflow = (numeric < low) | (numeric > high)
+        if overflow.any():
+            overflow_rows.append((name, series.index[overflow.values]))
+    return dtype_rows, overflow_rows
+
+
+def _integer_range(internal_type, connection):
+    """
+    Range of values the database can store for the integer field type.
+
+    Where the database doesn't say, e.g. sqlite, the range of a 64 bit
+    integer, or 0 upwards for positive fields.
+    """
+    low, high = connection.ops.integer_field_range(internal_type)
+    if low is None:
+        low = 0 if internal_type.startswith('Positive') else -2 ** 63
+    if high is None:
+        high = 2 ** 63 - 1
+    return low, high
+
+
+def _max_length_rows(self, plan, connection):
+    for name, series in _columns(self, plan.max_lengths):
+        max_length = plan.max_lengths[name]
+        if max_length is None:
+            continue
+        # measure each distinct value once, nulls get code -1.
+        codes, uniques = pd.factorize(series)
+        too_long = np.array([len(str(x)) > max_length for x in uniques],
+                            dtype=bool)
+        if too_long.any():
+            yield name, series.index[(codes >= 0) & too_long[codes]]
+
+
+def _choices_rows(self, plan, connection):
+    for name, series in _columns(self, plan.choices):
+        invalid = ~series.isin(plan.choices[name]) & series.notnull()
+        if invalid.any():
+            yield name, series.index[invalid.values]
+
+
+def _test_no_missing_columns(self, model):
+    """
+    Are there any necessary columns, that don't exist in the dataframe?
+    """
+    plan = _model_plan(model)
+    for column, _ in _missing_column_rows(self, plan, None):
+        raise PandasLovesPoniesException('missing column: %s' % column)
     return True
 
 
 def _test_dates_arent_strings(self, model):
-    from django.db.models import fields
-    def is_date_based_field(f):
-        if isinstance(f, fields.DateTimeField):
-            return True
-        elif isinstance(f, fields.DateField):
-            return True
-        else:
-            return False
-    obj = model()
-    date_fields = [x.name for x in obj._meta.fields
-                   if is_date_based_field(x) and x.name != 'id']
-    for date_field in date_fields:
-        date_series = _column_getter(self, date_field)
-        date_value = date_series.values[0]
-        if isinstance(date_value, str):
-            error_msg = 'date column %s is strings' % date_field
-            raise PandasLovesPoniesException(error_msg)
-        continue
+    plan = _model_plan(model)
+    for date_field, _ in _date_string_rows(self, plan, None):
+        error_msg = 'date column %s is strings' % date_field
+        raise PandasLovesPoniesException(error_msg)
     return True
 
 
@@ -86,26 +960,29 @@ def _test_invalid_nulls(self, model):
 
     Allows if default attribute set, as these will be filled in.
     """
-    from django.db.models import fields
-    obj = model()
-    nonnull_fields = [x for x in obj._meta.fields
-                    if not x.null and x.name != 'id']
-    for field in nonnull_fields:
-        if _has_default(field):
-            continue
-        nonnull_cols_series = _column_getter(self, field.name)
-        if nonnull_cols_series.isnull().any():
-            error_msg = '%s column contains nulls' % field.name
-            raise PandasLovesPoniesException(error_msg)
+    plan = _model_plan(model)
+    for column, _ in _null_rows(self, plan, None):
+        error_msg = '%s column contains nulls' % column
+        raise PandasLovesPoniesException(error_msg)
     return True
 
 
 def to_django(self, model, update=False, force_save=False,
               bulk_create_size=1000, utc_to_tz=None, write_to_db=True,
-              return_objects=False, validate=False):
+              return_objects=False, validate=False, mode=None, engine=None,
+              keep_tzinfo=False, workers=None, atomic='chunk',
+              commit_every=None, retries=0, stats=None, progress=None,
+              fk_lookups=None, fk_create=False, sync_delete=False,
+              returning=None, checkpoint=None, load_id=None,
+              on_duplicate=None):
     """
     Write DataFrame to SQL database via Django model.
 
+    Also accepts an iterable of DataFrames in place of the DataFrame, e.g.
+    pd.read_csv(..., chunksize=N), which are written one at a time so only
+    one chunk needs to be in memory. The model's fields are matched up
+    against the first DataFrame's columns.
+
     Parameters
     ----------
     model : Django model
@@ -113,24 +990,150 @@ def to_django(self, model, update=False, force_save=False,
     update: boolean, default False
         Whether to update existing records, rather than trying to create all
         new ones. It looks up existing records based on the Django model's
-        Meta.unique_togethers setting.
+        Meta.unique_togethers setting, or the primary key if not set. Existing
+        records are fetched with one query per chunk of rows.
     force_save: boolean, default False
         Don't do bulk create of records, force call to model's save() method.
         Use when you have written custom save() method you wish to call.
-    bulk_create_size: int, default 1000
-        if 'update' is False (default), then will attempt to do a bulk_create
-        which is much faster than continually calling Django model's save()
-        method.
+    bulk_create_size: int or 'auto', default 1000
+        Number of rows written at a time. Unless 'force_save' is set, each
+        chunk is written with a bulk_create (and a bulk_update of existing
+        records when 'update' is set), which is much faster than continually
+        calling Django model's save() method.
+        'auto': start from the most rows the backend takes in one INSERT of
+        the model, then adjust the size after each chunk, to the one with
+        the best rows/sec, keeping a chunk's objects within roughly 64MB.
+        With atomic='chunk' and no commit_every, each chunk is written in its
+        own transaction and timed through to its commit, whatever the mode
+        or engine. Otherwise chunks within a transaction are timed without
+        the commit, and the raw engine, sync and merge_via_staging modes
+        keep the size worked out at the start of each DataFrame. The sizes
+        are logged, and kept in stats' batch_sizes.
     utc_to_tz: str, default None
         if set, will conver datetimes from utc to this timezone.
+    keep_tzinfo: boolean, default False
+        When converting with 'utc_to_tz', keep the datetimes timezone aware,
+        rather than making them naive. Use with Django's USE_TZ = True.
     write_to_db: boolean, default True
         Whether to actually write to the database or not.
     return_objects: boolean, default False
         When True, will return a list of the django objects created from the
-        dataframe.
+        dataframe, the same as returning='objects'.
         Defaults to False so that we don't eat memory when dataframe is large.
     validate: boolean, default False
         When true, run validate_for_django() beforehand.
+    mode: str, default None
+        How records are written, when not set uses 'update' and 'force_save'.
+        'upsert': insert new records and update existing ones in a single
+        statement per chunk (INSERT ... ON CONFLICT DO UPDATE, or ON DUPLICATE
+        KEY UPDATE on MySQL). Conflicts are detected on the same key 'update'
+        uses. When the key is the primary key, it must be in the DataFrame.
+        'sync': only write rows that have changed. Existing records for the
+        DataFrame's keys are read a chunk at a time, and compared with
+        hashes of the relevant columns. New rows are bulk created, changed
+        rows bulk updated, and unchanged rows left alone. Returns a dict of
+        counts of 'created', 'updated', 'unchanged' and 'deleted' rows.
+        'merge_via_staging': for very large updates, load each DataFrame into
+        a temporary table with executemany(), then update existing records
+        with one UPDATE joined on the same key 'update' uses, and insert new
+        ones with one INSERT ... SELECT. Each DataFrame is merged in a single
+        transaction. Fields missing from the DataFrame get their default for
+        new records, save() and signals aren't called.
+    engine: str, default None
+        'raw': for plain inserts, skip creating Django model instances and
+        executemany a precompiled INSERT statement with the columns' values,
+        a chunk of 'bulk_create_size' rows at a time. Fields missing from the
+        DataFrame get their default. Model save() and signals are not called,
+        nor field pre_save() (e.g. auto_now).
+    workers: int, default None
+        When more than 1, split the DataFrame into this many contiguous
+        partitions, and write them at the same time from separate processes,
+        each with its own database connection (and transaction). Errors from
+        all partitions are gathered up, in partition order, into a single
+        exception. Processes are forked, which needs a platform that can fork,
+        no transaction open in the calling thread, and a database other
+        processes can reach (not in-memory SQLite); otherwise threads are
+        used, and their writes don't see any transaction open in the calling
+        thread.
+    atomic: str, default 'chunk'
+        Transaction control for the writes.
+        'chunk': each chunk of 'commit_every' rows is written in its own
+        transaction (a savepoint, if already in a transaction), so rows
+        aren't committed one at a time, and a failed chunk is rolled back.
+        'all': the whole load is written in one transaction. With workers,
+        partitions wait for each other before committing, and all roll back
+        if any failed, which needs a database that allows concurrent write
+        transactions, so not SQLite.
+        'partition': with workers, each partition is written in one
+        transaction, otherwise the same as 'all'.
+        None: no transaction control, each query is autocommitted.
+    commit_every: int, default None
+        Number of rows per transaction with atomic='chunk', defaults to
+        'bulk_create_size'.
+    retries: int, default 0
+        Number of times to retry a chunk that failed with an OperationalError
+        (e.g. deadlock, or database locked). The chunk is rolled back to its
+        savepoint before retrying.
+    stats: LoadStats or callable, default None
+        Collect statistics of the load: time spent in each phase, rows,
+        chunks, queries and bytes sent. Pass a LoadStats to have it filled
+        in, or a callable (e.g. log_stats, or a metrics sink) to be called
+        with the LoadStats once the load has finished.
+    progress: callable, default None
+        Called with the LoadStats after each chunk is flushed. With workers,
+        from the worker threads, or once per partition as each worker process
+        finishes.
+    fk_lookups: dict, default None
+        ForeignKey columns holding natural keys rather than ids, mapped to
+        the field of the related model to look them up by, e.g.
+        {'product': 'sku'}. Distinct keys are looked up with one IN query
+        per chunk, and kept in an LRU cache across chunks and calls.
+        Otherwise ForeignKey columns are expected to hold ids.
+    fk_create: boolean, default False
+        With fk_lookups, bulk create related records for keys that don't
+        exist yet, rather than raising an exception. Only the lookup field
+        is set on them, the rest get their defaults.
+    sync_delete: boolean or queryset, default False
+        With mode='sync', delete records whose keys aren't in the
+        DataFrame(s). True considers all of the model's records, or pass a
+        queryset to limit which can be deleted.
+    returning: str, default None
+        What to return for the rows written, when memory matters.
+        'objects': a list of the django objects, as return_objects=True.
+        'pks': a NumPy array of the objects' primary keys, in row order. New
+        records' ids come back from the INSERT on backends that return rows
+        from bulk inserts (PostgreSQL, SQLite 3.35+, MariaDB 10.5+), elsewhere
+        they are None, as are the ids of upserted records.
+        'iter': a generator, that does the load as it is iterated over,
+        yielding a list of django objects per chunk of 'bulk_create_size'
+        rows once it has been written (with atomic='chunk', once committed).
+        Only a chunk's objects are held in memory. Stopping early leaves the
+        rest of the rows unwritten, with any open transaction rolled back.
+    checkpoint: str, default None
+        Make the load resumable: after each chunk of 'commit_every' rows is
+        committed, record how many rows of the DataFrame are done, along
+        with a fingerprint of the DataFrame. Run again with the same
+        checkpoint and load_id to carry on after the last committed chunk,
+        skipping those already done. A path ending in '.json', or with a
+        directory, is a JSON file, written after each commit. Otherwise it
+        is the name of a table, created if need be, in the model's
+        database, written in the same transaction as the chunk. Needs
+        atomic='chunk', and can't be used with returning, workers or
+        sync_delete.
+    load_id: str, default None
+        Name of the load in the checkpoint, required with it. Use a new one
+        for a new load, as a finished load is skipped entirely.
+    on_duplicate: str or dict, default None
+        How to handle rows of a DataFrame with the same key (the same one
+        'update' uses), before anything is written. The number of rows
+        collapsed is logged, and counted in stats.
+        'first' or 'last': keep the first or last row for each key.
+        'error': raise an exception, rather than fail part way through.
+        'aggregate': one row per key, summing numeric columns, and keeping
+        the last non-null value of the others. Or pass a dict of column to
+        aggregation (e.g. 'sum', 'max', 'first'), with the same default for
+        columns not in it.
+        None: rows are written as they are.
 
 
     Note
@@ -138,91 +1141,1210 @@ def to_django(self, model, update=False, force_save=False,
     Will also attempt to use names of indexes as well as names of columns in
     the DataFrame.
     """
-    from django.db.models import fields
-    if validate:
-        validate_for_django(self, model)
-    # don't want to edit the df we were given.
-    df = self.copy()
-    do_bulk_create = not update and not force_save
-    if utc_to_tz:
-        def localize_datetime(x):
-            if pd.isnull(x) or isinstance(x, pd.tslib.NaTType):
-                return None
-            utz_tz = pytz.timezone('UTC')
-            local_tz = pytz.timezone(utc_to_tz)
-            d = utz_tz.localize(x)
-            d = d.astimezone(local_tz)
-            # make naive.
-            return d.replace(tzinfo=None)
+    if returning not in (None, 'objects', 'pks', 'iter'):
+        raise PandasLovesPoniesException('unknown returning: %s' % returning)
+    if return_objects and returning not in (None, 'objects'):
+        error_msg = 'return_objects can not be used with returning=%s' % (
+            returning)
+        raise PandasLovesPoniesException(error_msg)
+    if return_objects:
+        returning = 'objects'
+    if returning == 'iter' and workers and workers > 1:
+        error_msg = "returning='iter' can not use workers"
+        raise PandasLovesPoniesException(error_msg)
+    if mode not in (None, 'upsert', 'sync', 'merge_via_staging'):
+        raise PandasLovesPoniesException('unknown mode: %s' % mode)
+    if mode in ('sync', 'merge_via_staging') and (
+            returning or (workers and workers > 1)):
+        error_msg = "mode '%s' can not return objects or use workers" % mode
+        raise PandasLovesPoniesException(error_msg)
+    if mode and (update or force_save):
+        error_msg = 'mode %s can not be used with update or force_save' % mode
+        raise PandasLovesPoniesException(error_msg)
+    if engine not in (None, 'raw'):
+        raise PandasLovesPoniesException('unknown engine: %s' % engine)
+    if engine == 'raw' and (update or force_save or mode or returning):
+        error_msg = ('raw engine can only insert, not update, force_save, '
+                     'use a mode or return objects')
+        raise PandasLovesPoniesException(error_msg)
+    if atomic not in (None, 'chunk', 'all', 'partition'):
+        raise PandasLovesPoniesException('unknown atomic: %s' % atomic)
+    if not (on_duplicate in (None, 'first', 'last', 'error', 'aggregate') or
+            isinstance(on_duplicate, dict)):
+        error_msg = 'unknown on_duplicate: %s' % on_duplicate
+        raise PandasLovesPoniesException(error_msg)
+    if bulk_create_size == 'auto':
+        batch_size = _AutoBatchSize(model)
+        bulk_create_size = batch_size.size
+    else:
+        batch_size = None
+    if checkpoint is not None:
+        if load_id is None:
+            raise PandasLovesPoniesException('checkpoint needs a load_id')
+        if (atomic != 'chunk' or not write_to_db or returning or
+                (workers and workers > 1)):
+            error_msg = ("checkpoint needs atomic='chunk' and write_to_db, "
+                         "and can not return objects or use workers")
+            raise PandasLovesPoniesException(error_msg)
+        if mode == 'sync' and sync_delete is not False:
+            # rows skipped on resuming would have their records deleted.
+            error_msg = "checkpoint can not be used with sync_delete"
+            raise PandasLovesPoniesException(error_msg)
+        checkpoint = _checkpoint(checkpoint, load_id, model)
+    if isinstance(stats, LoadStats):
+        load_stats = stats
+        load_stats.progress = progress or load_stats.progress
+    elif stats is not None or progress is not None:
+        load_stats = LoadStats(progress)
+    else:
+        load_stats = _no_stats
+    start = default_timer()
+    options = dict(update=update, force_save=force_save,
+                   bulk_create_size=bulk_create_size, utc_to_tz=utc_to_tz,
+                   keep_tzinfo=keep_tzinfo, write_to_db=write_to_db,
+                   returning=returning, mode=mode, engine=engine,
+                   fk_lookups=fk_lookups, fk_create=fk_create,
+                   batch_size=batch_size, stats=load_stats)
+    if mode == 'sync':
+        counts = OrderedDict((x, 0) for x in
+                             ('created', 'updated', 'unchanged', 'deleted'))
+        # keys of all the rows, to work out which records to delete.
+        options['sync_state'] = (counts, set() if sync_delete is not False
+                                 else None)
+    else:
+        options['sync_state'] = None
+    if isinstance(self, pd.DataFrame):
+        frames = [self]
+    else:
+        frames = self
+    if on_duplicate is not None:
+        frames = (_collapse_duplicates(df, model, on_duplicate, load_stats)
+                  for df in frames)
+    parallel = workers and workers > 1 and write_to_db
+    if batch_size is not None and not commit_every:
+        # transactions follow the batch size.
+        commit_every = None
+    else:
+        commit_every = commit_every or bulk_create_size
+    args = (frames, model, validate, workers if parallel else None, atomic,
+            commit_every, retries, options, checkpoint)
+    load = _load(args, sync_delete, stats, start)
 
-    obj = model()
-    relevant_fields = []
-    # Create list of columns in DataFrame that are also in the Django model.
-    # Handle NaN's by setting to null if appropriate, or using the default.
-    for field in obj._meta.fields:
-        if field.name == 'id':
-            continue
-        if field.name in df or field.name in df.index.names:
-            relevant_fields.append(field)
-            if field.name in df.index.names:
-                try:
-                    # multi-index
-                    df[field.name] = df.index.get_level_values(field.name)
-                except AttributeError:
-                    # non-multi-index
-                    df[field.name] = df.index.values
-            if utc_to_tz and isinstance(field, fields.DateTimeField):
-                df[field.name] = df[field.name].map(localize_datetime)
-
-            if field.null:
-                pass
-            elif _has_default(field):
-                df[field.name].fillna(field.default, inplace=True)
-            elif isinstance(field, fields.CharField):
-                if all(df[field.name].isnull()):
-                    df[field.name] = ''
-                else:
-                    df[field.name].fillna('', inplace=True)
+    if mode == 'sync':
+        for _ in load:
+            pass
+        return options['sync_state'][0]
+    elif returning == 'iter':
+        return load
+    elif returning == 'pks':
+        return np.array([pk for pks in load for pk in pks])
+    elif returning == 'objects':
+        return [obj for objs in load for obj in objs]
+    else:
+        for _ in load:
+            pass
+        return None
 
-    objs = []
-    if return_objects:
-        all_objs = []
-    # iterate through DataFrame, creating/updating Django model instances.
-    for _, row in df.iterrows():
-        if not update:
-            obj = model()
+
+def to_django_many(self, models, relations=None, bulk_create_size=1000,
+                   utc_to_tz=None, keep_tzinfo=False, validate=False):
+    """
+    Write a denormalized DataFrame out to several related Django models.
+
+    e.g. order header and line item columns in the same rows:
+
+        to_django_many(df, OrderedDict([(Order, ['number', 'customer']),
+                                        (OrderLine, ['sku', 'quantity'])]))
+
+    Parent rows are deduplicated, bulk created, and their primary keys
+    mapped onto the rows of the models referencing them, so the number of
+    queries only grows with the number of chunks of 'bulk_create_size'
+    rows. Everything is written in one transaction.
+
+    Parameters
+    ----------
+    models : OrderedDict of Django model to columns
+        The models to write, parents before their children. The columns are
+        a list of DataFrame columns named after the model's fields, or a
+        dict of DataFrame column to field name.
+    relations: dict, default None
+        For each model, a dict of its ForeignKey fields to the model in
+        'models' they are set from, e.g. {OrderLine: {'order': Order}}. When
+        not given, ForeignKeys to models earlier in 'models' are used.
+    bulk_create_size, utc_to_tz, keep_tzinfo, validate
+        As for to_django().
+
+    Returns a dict of model to a NumPy array of the primary keys of the
+    records created for it. Models referenced by others get a record per
+    distinct row, the rest a record per row. Needs a backend that returns
+    ids from bulk inserts (PostgreSQL, SQLite 3.35+, MariaDB 10.5+).
+    """
+    from django.db import router, transaction
+    models = OrderedDict(models)
+    order = list(models)
+    if relations is None:
+        relations = {}
+        for i, model in enumerate(order):
+            columns = _many_columns(models[model]).values()
+            relations[model] = {
+                field.name: field.related_model for field in model._meta.fields
+                if field.many_to_one and field.related_model in order[:i] and
+                field.name not in columns}
+    parents = set()
+    for model, model_relations in relations.items():
+        for parent in model_relations.values():
+            missing = [x for x in (model, parent) if x not in order]
+            if missing:
+                error_msg = '%s is in relations but not in models' % (
+                    missing[0].__name__)
+                raise PandasLovesPoniesException(error_msg)
+            if order.index(parent) >= order.index(model):
+                error_msg = '%s must come before %s' % (parent.__name__,
+                                                        model.__name__)
+                raise PandasLovesPoniesException(error_msg)
+            parents.add(parent)
+
+    row_pks = {}
+    created = {}
+    with transaction.atomic(using=router.db_for_write(order[0])):
+        for model, columns in models.items():
+            columns = _many_columns(columns)
+            frame = self[list(columns)].rename(columns=columns)
+            frame.index = pd.RangeIndex(len(frame))
+            for name, parent in relations.get(model, {}).items():
+                frame[name] = row_pks[parent]
+            if model in parents:
+                # one record per distinct row, numbered in order of first
+                # appearance.
+                groups = frame.groupby(list(frame.columns), sort=False,
+                                       dropna=False).ngroup().values
+                frame = frame[~pd.Series(groups).duplicated().values]
+            else:
+                groups = None
+            pks = to_django(frame, model, bulk_create_size=bulk_create_size,
+                            utc_to_tz=utc_to_tz, keep_tzinfo=keep_tzinfo,
+                            validate=validate, atomic=None, returning='pks')
+            if len(pks) and pd.isnull(pks).any():
+                error_msg = ('%s ids not returned from bulk insert, the '
+                             'database must support it' % model.__name__)
+                raise PandasLovesPoniesException(error_msg)
+            created[model] = pks
+            row_pks[model] = pks if groups is None else pks[groups]
+    return created
+
+
+def _many_columns(columns):
+    """
+    Columns for to_django_many(), as a dict of DataFrame column to field name.
+    """
+    if isinstance(columns, dict):
+        return OrderedDict(columns)
+    return OrderedDict((column, column) for column in columns)
+
+
+def _collapse_duplicates(df, model, on_duplicate, stats):
+    """
+    Collapse rows of df with the same key, see to_django()'s on_duplicate.
+
+    Duplicates are found with one pass over the key columns, df is returned
+    as it is when there are none.
+    """
+    key_fields = _model_plan(model).key_fields
+    key_names = [field.name for field in key_fields]
+    if not all(name in df or name in df.index.names for name in key_names):
+        # e.g. an auto primary key, not in the DataFrame.
+        return df
+    keys = pd.DataFrame({name: _column_getter(df, name).values
+                         for name in key_names})
+    keep = 'first' if on_duplicate == 'first' else 'last'
+    duplicated = keys.duplicated(keep=keep).values
+    collapsed = int(duplicated.sum())
+    if not collapsed:
+        return df
+    if on_duplicate == 'error':
+        examples = keys[duplicated].drop_duplicates().head(5)
+        error_msg = '%d duplicate rows for %s, e.g. %s' % (
+            collapsed, ', '.join(key_names),
+            '; '.join(repr(tuple(x)) for x in examples.values.tolist()))
+        raise PandasLovesPoniesException(error_msg)
+    logger.info('to_django: collapsed %d duplicate rows of %s',
+                collapsed, model.__name__)
+    stats.add_duplicates(collapsed)
+    if on_duplicate in ('first', 'last'):
+        return df[~duplicated]
+    # fields held in the index are aggregated too, so they aren't lost.
+    index_names = [name for name in df.index.names
+                   if name is not None and name not in key_names and
+                   name not in df]
+    if index_names:
+        df = df.reset_index(level=index_names)
+    values = df.drop(columns=[name for name in key_names if name in df])
+    if not len(values.columns):
+        return df[~duplicated]
+    aggregations = on_duplicate if isinstance(on_duplicate, dict) else {}
+    numeric = set(_model_plan(model).numeric_fields)
+    # one row per key, in order of first appearance.
+    grouped = values.groupby([keys[name].values for name in key_names],
+                             sort=False, dropna=False)
+    values = grouped.agg(OrderedDict(
+        (column, aggregations.get(column, 'sum' if column in numeric
+                                  else 'last'))
+        for column in values))
+    values.index.names = key_names
+    return values.reset_index()
+
+
+def _load(args, sync_delete, stats, start):
+    """
+    Generator doing the load for to_django(), yielding what's returned for
+    each chunk, if returning.
+    """
+    from django.db import router, transaction
+    (frames, model, validate, workers, atomic, commit_every, retries, options,
+     checkpoint) = args
+    write_to_db = options['write_to_db']
+    sync = options['mode'] == 'sync' and write_to_db
+    load_stats = options['stats']
+    if atomic in ('all', 'partition') and write_to_db and not workers:
+        with transaction.atomic(using=router.db_for_write(model)):
+            for chunk in _write_frames(*args):
+                yield chunk
+            if sync and sync_delete is not False:
+                _sync_delete(model, sync_delete, options['sync_state'],
+                             options['bulk_create_size'])
+    else:
+        for chunk in _write_frames(*args):
+            yield chunk
+        if sync and sync_delete is not False:
+            with transaction.atomic(using=router.db_for_write(model)):
+                _sync_delete(model, sync_delete, options['sync_state'],
+                             options['bulk_create_size'])
+    batch_size = options['batch_size']
+    if batch_size is not None and batch_size.sizes:
+        logger.info('to_django: bulk_create_size auto, %d batches, from %d '
+                    'to %d rows, ending at %d', len(batch_size.sizes),
+                    min(batch_size.sizes), max(batch_size.sizes),
+                    batch_size.size)
+        if load_stats is not _no_stats:
+            load_stats.batch_sizes = list(batch_size.sizes)
+    if load_stats is not _no_stats:
+        load_stats.seconds = default_timer() - start
+        if stats is not load_stats and stats is not None:
+            stats(load_stats)
+
+
+def _write_frames(frames, model, validate, workers, atomic, commit_every,
+                  retries, options, checkpoint=None):
+    """
+    Write each of the DataFrames, see to_django() for the parameters.
+
+    Yields what's returned for each chunk, if returning.
+    """
+    from django.db import connections, router
+    stats = options['stats']
+    with stats.counting(connections[router.db_for_write(model)]):
+        for chunk in _write_frames_counted(frames, model, validate, workers,
+                                           atomic, commit_every, retries,
+                                           options, checkpoint):
+            yield chunk
+
+
+def _write_frames_counted(frames, model, validate, workers, atomic,
+                          commit_every, retries, options, checkpoint):
+    """
+    Body of _write_frames(), run while counting queries.
+    """
+    stats = options['stats']
+    relevant_fields = None
+    for i, df in enumerate(frames):
+        if validate:
+            with stats.phase('validate'):
+                validate_for_django(df, model)
+        if relevant_fields is None:
+            # worked out once, from the first DataFrame.
+            relevant_fields = _relevant_fields(df, model)
         else:
+            _test_has_columns(df, relevant_fields)
+        if options['batch_size'] is not None:
+            options['batch_size'].fit(df)
+            options['bulk_create_size'] = options['batch_size'].size
+        if workers:
+            chunks = _write_partitioned(df, model, relevant_fields, workers,
+                                        atomic, commit_every, retries, options)
+        elif checkpoint is not None:
+            chunks = _write_chunks(df, model, relevant_fields, atomic,
+                                   commit_every, retries, options,
+                                   checkpoint.start_frame(i, df))
+        else:
+            chunks = _write_chunks(df, model, relevant_fields, atomic,
+                                   commit_every, retries, options)
+        for chunk in chunks:
+            yield chunk
+
+
+def _write_chunks(df, model, relevant_fields, atomic, commit_every, retries,
+                  options, checkpoint=None):
+    """
+    Write df a commit_every rows at a time, each in its own transaction.
+
+    Only when atomic='chunk' or retrying, otherwise df is written in one go.
+    Chunks are retried up to retries times on OperationalError. Yields what's
+    returned for each chunk, if returning, once its transaction committed.
+    With a checkpoint, rows it has done are skipped, and progress recorded
+    for each chunk.
+    """
+    from django.db import OperationalError, router, transaction
+    if options['mode'] == 'merge_via_staging':
+        # merged in one go, through a single staging table.
+        commit_every = max(len(df), 1)
+    if not options['write_to_db'] or (atomic != 'chunk' and not retries):
+        for chunk in _write_frame(df, model, relevant_fields, **options):
+            yield chunk
+        return
+    alias = router.db_for_write(model)
+    # with bulk_create_size='auto' and no commit_every, each batch is written
+    # in its own transaction, and timed through to its commit.
+    batch_size = options['batch_size'] if not commit_every else None
+    start = checkpoint.rows_done if checkpoint is not None else 0
+    while start < len(df):
+        chunk = df.iloc[start:start + (commit_every or batch_size.size)]
+        if batch_size is None:
+            chunk_options = options
+        else:
+            chunk_options = dict(options, batch_size=None,
+                                 bulk_create_size=len(chunk))
+        for attempt in range(retries + 1):
+            chunk_start = default_timer()
             try:
-                unique_togethers = model._meta.unique_together[0]
-                kwargs = {field: row[field] for field in unique_togethers}
-            except IndexError:
-                for field in model._meta.fields:
-                    if field.primary_key:
-                        kwargs = {field.name: row[field.name]}
-            try:
-                obj = model.objects.get(**kwargs)
-            except model.DoesNotExist:
-                obj = model()
+                with transaction.atomic(using=alias):
+                    returned = list(_write_frame(chunk, model,
+                                                 relevant_fields,
+                                                 **chunk_options))
+                    if checkpoint is not None and checkpoint.transactional:
+                        checkpoint.record(start + len(chunk))
+                break
+            except OperationalError:
+                if attempt == retries:
+                    raise
+        if batch_size is not None:
+            batch_size.observe(len(chunk), default_timer() - chunk_start)
+        if checkpoint is not None and not checkpoint.transactional:
+            # only once committed, the chunk's transaction may have been a
+            # savepoint in the caller's.
+            transaction.on_commit(functools.partial(
+                checkpoint.record, start + len(chunk)), using=alias)
+        start += len(chunk)
+        for chunk_returned in returned:
+            yield chunk_returned
+
+
+def _test_has_columns(df, relevant_fields):
+    """
+    Does the DataFrame have a column (or index) for each of the fields?
+    """
+    for field in relevant_fields:
+        if field.name not in df and field.name not in df.index.names:
+            raise PandasLovesPoniesException('missing column: %s' % field.name)
+    return True
+
+
+def _checkpoint(checkpoint, load_id, model):
+    """
+    The checkpoint for to_django(), a file or a table.
+    """
+    if checkpoint.endswith('.json') or os.path.dirname(checkpoint):
+        return _FileCheckpoint(checkpoint, load_id)
+    return _TableCheckpoint(checkpoint, load_id, model)
+
+
+def _fingerprint(df):
+    """
+    Hash of the DataFrame's columns, index and values, in order.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=True).values
+    fingerprint = hashlib.sha1(repr(list(df.columns)).encode('utf-8'))
+    fingerprint.update(hashes.tobytes())
+    return fingerprint.hexdigest()
+
+
+class _Checkpoint(object):
+    """
+    Rows done of each DataFrame of a load, to resume it after a failure.
+
+    Subclasses read and write the progress, a dict of the DataFrame's number
+    to its fingerprint and rows done.
+    """
+    # whether record() goes in the chunk's transaction.
+    transactional = False
+
+    def __init__(self, load_id):
+        self.load_id = load_id
+        self.progress = self.read()
+        self.frame = None
+        self.fingerprint = None
+        self.rows_done = 0
+
+    def start_frame(self, frame, df):
+        """
+        Start on the frame'th DataFrame, returns self with its rows_done.
+        """
+        self.frame = frame
+        self.fingerprint = _fingerprint(df)
+        fingerprint, self.rows_done = self.progress.get(frame, (None, 0))
+        if fingerprint is not None and fingerprint != self.fingerprint:
+            error_msg = ('DataFrame %d of load %s has changed since it was '
+                         'checkpointed' % (frame, self.load_id))
+            raise PandasLovesPoniesException(error_msg)
+        return self
+
+    def record(self, rows_done):
+        """
+        Record rows_done of the current DataFrame as committed.
+        """
+        self.rows_done = rows_done
+        self.progress[self.frame] = (self.fingerprint, rows_done)
+        self.write(self.frame, self.fingerprint, rows_done)
+
+
+class _FileCheckpoint(_Checkpoint):
+    """
+    Checkpoint kept in a JSON file, which can hold several loads.
+
+    Rewritten after each commit, via a temporary file that's fsync'd then
+    renamed over it, so it's never left half written.
+    """
+    def __init__(self, path, load_id):
+        self.path = path
+        super(_FileCheckpoint, self).__init__(load_id)
+
+    def _read_file(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def read(self):
+        return {int(frame): tuple(done) for frame, done in
+                self._read_file().get(self.load_id, {}).items()}
+
+    def write(self, frame, fingerprint, rows_done):
+        loads = self._read_file()
+        loads.setdefault(self.load_id, {})[str(frame)] = [fingerprint,
+                                                          rows_done]
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump(loads, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class _TableCheckpoint(_Checkpoint):
+    """
+    Checkpoint kept in a table in the model's database, so progress is
+    committed along with the chunk.
+    """
+    transactional = True
+
+    def __init__(self, table, load_id, model):
+        from django.db import connections, router
+        self.connection = connections[router.db_for_write(model)]
+        self.table = self.connection.ops.quote_name(table)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS %s (load_id varchar(255) NOT '
+                'NULL, frame integer NOT NULL, fingerprint varchar(40) NOT '
+                'NULL, rows_done bigint NOT NULL, PRIMARY KEY (load_id, '
+                'frame))' % self.table)
+        super(_TableCheckpoint, self).__init__(load_id)
+
+    def read(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT frame, fingerprint, rows_done FROM %s '
+                           'WHERE load_id = %%s' % self.table, [self.load_id])
+            return {frame: (fingerprint, rows_done)
+                    for frame, fingerprint, rows_done in cursor.fetchall()}
+
+    def write(self, frame, fingerprint, rows_done):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE load_id = %%s AND frame = %%s'
+                           % self.table, [self.load_id, frame])
+            cursor.execute('INSERT INTO %s (load_id, frame, fingerprint, '
+                           'rows_done) VALUES (%%s, %%s, %%s, %%s)'
+                           % self.table,
+                           [self.load_id, frame, fingerprint, rows_done])
+
+
+class _Rollback(Exception):
+    """
+    Raised to roll back a partition's transaction.
+    """
+
+
+def _write_partitioned(df, model, relevant_fields, workers, atomic,
+                       commit_every, retries, options):
+    """
+    Write contiguous partitions of df at the same time, one process each.
+
+    Partitions are written from forked processes, so converting them isn't
+    held up by the GIL, or from threads where processes can't be used (see
+    _process_context). Each gets its own database connection. With
+    atomic='partition' each partition is written in a transaction, with
+    atomic='all' partitions also wait for each other and all roll back if any
+    failed. Yields what's returned for the partitions' chunks, in order, if
+    returning.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from django.db import connections, router, transaction
+    alias = router.db_for_write(model)
+    if atomic == 'all' and connections[alias].vendor == 'sqlite':
+        error_msg = ("atomic='all' with workers needs concurrent write "
+                     "transactions, which sqlite doesn't allow")
+        raise PandasLovesPoniesException(error_msg)
+    bounds = [len(df) * i // workers for i in range(workers + 1)]
+    partitions = [df.iloc[start:stop]
+                  for start, stop in zip(bounds[:-1], bounds[1:])]
+    results = [None] * workers
+    errors = [None] * workers
+    context = _process_context(connections[alias])
+    if context is None:
+        barrier = threading.Barrier(workers)
+    else:
+        barrier = context.Barrier(workers)
+
+    def write_partition(i):
+        try:
+            results[i] = list(_write_chunks(partitions[i], model,
+                                            relevant_fields, atomic,
+                                            commit_every, retries, options))
+        except Exception as e:
+            errors[i] = e
+
+    def write(i):
+        with options['stats'].counting(connections[alias]):
+            write_in_transaction(i)
+
+    def write_in_transaction(i):
+        try:
+            if atomic not in ('all', 'partition'):
+                write_partition(i)
+                return
+            with transaction.atomic(using=alias):
+                write_partition(i)
+                if errors[i] is not None:
+                    raise _Rollback()
+                if atomic == 'all':
+                    # wait until every partition is written, a failed one
+                    # aborts the wait so they all roll back.
+                    barrier.wait()
+        except (_Rollback, threading.BrokenBarrierError):
+            pass
+        except Exception as e:
+            errors[i] = e
+        finally:
+            if errors[i] is not None:
+                barrier.abort()
+            connections[alias].close()
 
+    if context is None:
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(write, range(workers)))
+    else:
+        _run_processes(context, workers, write, results, errors, options)
+
+    failed = [(i, e) for i, e in enumerate(errors) if e is not None]
+    if failed:
+        error_msg = '%d of %d partitions failed: %s' % (
+            len(failed), workers,
+            '; '.join('partition %d (rows %d to %d): %r' % (
+                i, bounds[i], bounds[i + 1] - 1, e) for i, e in failed))
+        exception = PandasLovesPoniesException(error_msg)
+        exception.errors = failed
+        raise exception
+    for chunks in results:
+        for chunk in chunks:
+            yield chunk
+
+
+def _process_context(connection):
+    """
+    The multiprocessing context to write partitions from, or None for threads.
+
+    Processes are forked, so they share the DataFrame without copying it, and
+    this thread's connections are closed first so none is shared with them.
+    Not when a transaction is open on the connection, nor for an in-memory
+    SQLite database, which other processes can't see.
+    """
+    import multiprocessing
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    if connection.in_atomic_block:
+        return None
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return None
+    return multiprocessing.get_context('fork')
+
+
+def _run_processes(context, workers, write, results, errors, options):
+    """
+    Call write(i) for each partition in a forked process, and gather up the
+    partitions' results, errors and statistics.
+    """
+    import pickle
+    from queue import Empty
+    from django.db import connections
+    stats = options['stats']
+    queue = context.Queue()
+
+    def run(i):
+        if isinstance(stats, LoadStats):
+            options['stats'] = LoadStats()
+        write(i)
+        partition_stats = options['stats']
+        if not isinstance(partition_stats, LoadStats):
+            partition_stats = None
+        elif options['batch_size'] is not None:
+            partition_stats.batch_sizes = list(options['batch_size'].sizes)
+        try:
+            payload = pickle.dumps((results[i], errors[i], partition_stats))
+        except Exception as e:
+            error = errors[i] or e
+            payload = pickle.dumps((None, PandasLovesPoniesException(
+                repr(error)), partition_stats))
+        queue.put((i, payload))
+
+    connections.close_all()
+    processes = [context.Process(target=run, args=(i,))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    pending = set(range(workers))
+    while pending:
+        try:
+            i, payload = queue.get(timeout=1)
+        except Empty:
+            for i in list(pending):
+                exitcode = processes[i].exitcode
+                # give a result put just before exiting time to arrive.
+                if exitcode is not None and queue.empty():
+                    errors[i] = PandasLovesPoniesException(
+                        'process exited with code %d' % exitcode)
+                    pending.discard(i)
+            continue
+        pending.discard(i)
+        try:
+            results[i], errors[i], partition_stats = pickle.loads(payload)
+        except Exception as e:
+            errors[i] = e
+            continue
+        if partition_stats is not None:
+            stats.merge(partition_stats)
+    for process in processes:
+        process.join()
+
+
+def _write_frame(self, model, relevant_fields, update, force_save,
+                 bulk_create_size, utc_to_tz, keep_tzinfo, write_to_db,
+                 returning, mode, engine, fk_lookups, fk_create,
+                 sync_state, batch_size, stats):
+    """
+    Write a single DataFrame, see to_django() for the parameters.
+
+    Yields, for each chunk once written, its django objects, or their primary
+    keys with returning='pks'. Yields nothing when not returning.
+    """
+    plan = _model_plan(model)
+    # only the relevant columns are read out of the DataFrame, it is never
+    # copied or edited.
+    df = self
+    names = [field.name for field in relevant_fields]
+    # instances are built with attnames, e.g. product_id for a ForeignKey.
+    attnames = [field.attname for field in relevant_fields]
+    # Pull each column out once as a list of python values, handling NaN's
+    # for the whole column, rather than boxing every row into a Series.
+    columns = []
+    with stats.phase('prepare'):
         for field in relevant_fields:
-            if field.null and pd.isnull(row[field.name]):
-                setattr(obj, field.name, None)
+            series = _column_getter(df, field.name)
+            if fk_lookups and field.name in fk_lookups:
+                series = _resolve_foreign_keys(series, field,
+                                               fk_lookups[field.name],
+                                               fk_create, bulk_create_size)
+            if utc_to_tz and field.name in plan.datetime_fields:
+                series = _utc_to_tz(series, utc_to_tz, keep_tzinfo)
+            columns.append(_column_values(series, field, plan))
+    if mode in ('upsert', 'sync', 'merge_via_staging'):
+        key_fields = plan.key_fields
+        for field in key_fields:
+            if field.name in names:
+                continue
+            if field.name not in df and field.name not in df.index.names:
+                error_msg = 'missing key column: %s' % field.name
+                raise PandasLovesPoniesException(error_msg)
+            names.append(field.name)
+            attnames.append(field.attname)
+            columns.append(_python_values(_column_getter(df, field.name),
+                                          field, plan))
+        key_names = [field.name for field in key_fields]
+        update_names = [name for name in names if name not in key_names]
+    if mode == 'sync':
+        _sync_frame(model, names, attnames, columns, key_names, update_names,
+                    bulk_create_size, write_to_db, sync_state, stats)
+        return
+    if mode == 'merge_via_staging':
+        if write_to_db:
+            _merge_via_staging(model, names, columns, key_names, update_names,
+                               len(df), bulk_create_size, stats)
+        return
+    if engine == 'raw':
+        if write_to_db:
+            _raw_insert(model, names, columns, len(df), bulk_create_size,
+                        stats)
+        return
+    if columns:
+        rows = zip(*columns)
+    else:
+        rows = [()] * len(df)
+    if update:
+        # keys used to look up existing records, one tuple per row.
+        key_fields = plan.key_fields
+        key_columns = []
+        for field in key_fields:
+            if field.name in names:
+                key_columns.append(columns[names.index(field.name)])
             else:
-                setattr(obj, field.name, row[field.name])
-        if do_bulk_create:
-            objs.append(obj)
-            if len(objs) == bulk_create_size:
-                if write_to_db:
+                key_columns.append(_python_values(
+                    _column_getter(df, field.name), field, plan))
+        rows = zip(rows, zip(*key_columns))
+
+    # work through the rows a chunk at a time, creating/updating Django model
+    # instances.
+    if batch_size is not None:
+        rows = _chunks(rows, lambda: batch_size.size)
+    else:
+        rows = _chunks(rows, bulk_create_size)
+    while True:
+        # batches are timed here when they don't each get their own
+        # transaction from _write_chunks(), e.g. with commit_every.
+        chunk_start = default_timer()
+        with stats.phase('build'):
+            chunk = next(rows, None)
+            if chunk is None:
+                break
+            if update:
+                new_objs, existing_objs, objs = _update_objects(
+                    model, attnames, key_fields, chunk, stats)
+            else:
+                objs = [model(**dict(zip(attnames, values)))
+                        for values in chunk]
+        if write_to_db:
+            with stats.phase('write'):
+                if force_save:
+                    for obj in objs:
+                        obj.save()
+                elif update:
+                    model.objects.bulk_create(new_objs)
+                    if existing_objs and names:
+                        model.objects.bulk_update(existing_objs, names)
+                elif mode == 'upsert':
+                    _upsert(model, objs, key_names, update_names)
+                else:
                     model.objects.bulk_create(objs)
-                objs = []
-        elif write_to_db:
-            obj.save()
-        if return_objects:
-            all_objs.append(obj)
-    if do_bulk_create and write_to_db:
-        model.objects.bulk_create(objs)
+        stats.add_chunk(len(chunk))
+        if batch_size is not None:
+            batch_size.observe(len(chunk), default_timer() - chunk_start)
+        if returning == 'pks':
+            yield [obj.pk for obj in objs]
+        elif returning:
+            yield objs
 
-    if return_objects:
-        return all_objs
+
+def _upsert(model, objs, key_names, update_names):
+    """
+    Insert objs, updating the update_names of records whose keys exist.
+
+    Backends without a conflict target (MySQL's ON DUPLICATE KEY UPDATE)
+    don't take unique_fields, they update on any unique key.
+    """
+    from django.db import connections, router
+    connection = connections[router.db_for_write(model)]
+    if update_names:
+        if connection.features.supports_update_conflicts_with_target:
+            unique_fields = key_names
+        else:
+            unique_fields = None
+        model.objects.bulk_create(objs, update_conflicts=True,
+                                  unique_fields=unique_fields,
+                                  update_fields=update_names)
     else:
+        model.objects.bulk_create(objs, ignore_conflicts=True)
+
+
+def _sync_frame(model, names, attnames, columns, key_names, update_names,
+                chunk_size, write_to_db, sync_state, stats):
+    """
+    Write only the new and changed rows, for to_django(mode='sync').
+
+    Rows are compared with the existing records with the same keys, read a
+    chunk at a time, by hashing the columns. When rows share a key the last
+    one is used.
+    """
+    counts, seen_keys = sync_state
+    fields = [model._meta.get_field(name) for name in names]
+    with stats.phase('prepare'):
+        frame = pd.DataFrame(OrderedDict(
+            (name, _comparable(values, field))
+            for name, values, field in zip(names, columns, fields)))
+        frame = frame.drop_duplicates(key_names, keep='last')
+        frame['_hash'] = pd.util.hash_pandas_object(frame[names], index=False)
+    if seen_keys is not None:
+        seen_keys.update(zip(*[frame[x].tolist() for x in key_names]))
+    dtypes = [None] + [_django_dtype(model, name) for name in names]
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start:start + chunk_size]
+        with stats.phase('fetch'):
+            lookups = {}
+            for name in key_names:
+                lookups['%s__in' % name] = chunk[name].dropna().unique().tolist()
+            rows = model._default_manager.filter(**lookups).values_list(
+                'pk', *names)
+            existing = _rows_to_frame(rows, ['_pk'] + names, dtypes, None)
+            for name, field in zip(names, fields):
+                existing[name] = _comparable(existing[name].tolist(), field)
+            existing['_existing_hash'] = pd.util.hash_pandas_object(
+                existing[names], index=False)
+            # object, so the merge's missing values for new rows don't turn
+            # the hashes and pks into floats.
+            existing = existing.astype({'_pk': object,
+                                        '_existing_hash': object})
+            merged = chunk[key_names + ['_hash']].merge(
+                existing[key_names + ['_pk', '_existing_hash']],
+                on=key_names, how='left')
+        is_new = merged['_pk'].isnull().values
+        is_changed = ~is_new & (merged['_hash'].values !=
+                                merged['_existing_hash'].values)
+        with stats.phase('build'):
+            # rows of frame are still numbered as in columns.
+            positions = chunk.index.values
+            new_objs = [model(**dict(zip(attnames,
+                                         [x[i] for x in columns])))
+                        for i in positions[is_new]]
+            changed_objs = []
+            for i, pk in zip(positions[is_changed],
+                             merged['_pk'].values[is_changed]):
+                obj = model(**dict(zip(attnames, [x[i] for x in columns])))
+                obj.pk = pk
+                changed_objs.append(obj)
+        if write_to_db:
+            with stats.phase('write'):
+                model._default_manager.bulk_create(new_objs)
+                if changed_objs and update_names:
+                    model._default_manager.bulk_update(changed_objs,
+                                                       update_names)
+        counts['created'] += len(new_objs)
+        counts['updated'] += len(changed_objs)
+        counts['unchanged'] += len(chunk) - len(new_objs) - len(changed_objs)
+        stats.add_chunk(len(chunk))
+
+
+def _comparable(values, field):
+    """
+    Series of the values, with the same dtype whether they were read from a
+    DataFrame or the database, so they hash the same.
+    """
+    from django.conf import settings
+    from django.utils import timezone
+    if field.get_internal_type() == 'DateField':
+        return pd.to_datetime(pd.Series(values, dtype=object), errors='coerce')
+    if field.get_internal_type() == 'DateTimeField' and settings.USE_TZ:
+        # naive datetimes are in the current time zone, as Django saves them.
+        tz = timezone.get_current_timezone()
+        values = [timezone.make_aware(value, tz)
+                  if not pd.isnull(value) and timezone.is_naive(value)
+                  else value for value in values]
+        return pd.to_datetime(pd.Series(values, dtype=object), utc=True)
+    if field.get_internal_type() == 'DecimalField':
+        # Decimals to the field's places, as the database stores them, from
+        # floats or Decimals alike.
+        places = decimal.Decimal(1).scaleb(-field.decimal_places)
+        return pd.Series([None if pd.isnull(value) else
+                          field.to_python(value).quantize(places)
+                          for value in values], dtype=object)
+    dtype = _django_dtype(field.model, field.name)
+    try:
+        return pd.Series(values, dtype=dtype)
+    except (ValueError, TypeError, OverflowError):
+        return pd.Series(values, dtype=object)
+
+
+def _sync_delete(model, queryset, sync_state, chunk_size):
+    """
+    Delete records whose keys weren't in the DataFrame(s), for mode='sync'.
+    """
+    counts, seen_keys = sync_state
+    if queryset is True:
+        queryset = model._default_manager.all()
+    key_fields = _model_plan(model).key_fields
+    rows = queryset.values_list(
+        'pk', *[field.name for field in key_fields]).iterator(
+        chunk_size=chunk_size)
+    pks = []
+    for chunk in _chunks(rows, chunk_size):
+        # keys typed the same as the DataFrame's were.
+        keys = zip(*[_comparable([row[i + 1] for row in chunk], field).tolist()
+                     for i, field in enumerate(key_fields)])
+        pks.extend(row[0] for row, key in zip(chunk, keys)
+                   if key not in seen_keys)
+    for chunk in _chunks(pks, chunk_size):
+        model._default_manager.filter(pk__in=chunk).delete()
+    counts['deleted'] += len(pks)
+
+
+ChunkResult = namedtuple('ChunkResult', ['index', 'rows', 'prepare_seconds',
+                                         'write_seconds', 'error'])
+
+
+async def ato_django(self, model, chunksize=None, queue_size=2,
+                     errors='raise', force_save=False, bulk_create_size=1000,
+                     utc_to_tz=None, keep_tzinfo=False, validate=False,
+                     mode=None):
+    """
+    Write DataFrame to SQL database via Django model, from asyncio code.
+
+    Conversion of rows to model instances is pipelined with the writes: the
+    next chunk is converted in a worker thread, while the current one is
+    written through Django's sync_to_async(), so the event loop isn't
+    blocked, and the load takes closer to the longer of the two rather than
+    their sum.
+
+    Parameters
+    ----------
+    model : Django model
+        Model used for writing out the DataFrame's contents.
+    chunksize: int, default None
+        Rows per chunk, defaults to 'bulk_create_size'. Also accepts an
+        iterable of DataFrames, as to_django() does, which are split into
+        chunks of at most this size.
+    queue_size: int, default 2
+        Number of converted chunks that can wait to be written, before
+        conversion waits for the writes to catch up.
+    errors: str, default 'raise'
+        'raise': stop at the first chunk that fails, and raise its error.
+        'collect': carry on, reporting the errors in the results.
+        Either way, an error reading the next DataFrame from an iterable is
+        raised.
+    force_save, bulk_create_size, utc_to_tz, keep_tzinfo, validate, mode
+        As for to_django(), mode can be None or 'upsert', and
+        bulk_create_size must be an int.
+
+    Returns a list of ChunkResult, one per chunk, with the seconds spent
+    converting and writing it, and its error, if any. Each chunk is written
+    in its own transaction.
+    """
+    import asyncio
+    from asgiref.sync import sync_to_async
+    from django.db import router, transaction
+    if mode not in (None, 'upsert'):
+        raise PandasLovesPoniesException('unknown mode: %s' % mode)
+    if errors not in ('raise', 'collect'):
+        raise PandasLovesPoniesException('unknown errors: %s' % errors)
+    chunksize = chunksize or bulk_create_size
+    frames = [self] if isinstance(self, pd.DataFrame) else self
+    chunks = (df.iloc[start:start + chunksize]
+              for df in frames for start in range(0, len(df), chunksize))
+    options = dict(update=False, force_save=force_save,
+                   bulk_create_size=bulk_create_size, utc_to_tz=utc_to_tz,
+                   keep_tzinfo=keep_tzinfo, write_to_db=False,
+                   returning='objects', mode=mode, engine=None,
+                   fk_lookups=None, fk_create=False, sync_state=None,
+                   batch_size=None, stats=_no_stats)
+    plan = _model_plan(model)
+    key_names = [field.name for field in plan.key_fields]
+    fields = []
+
+    def prepare(df):
+        start = default_timer()
+        if validate:
+            validate_for_django(df, model)
+        if not fields:
+            fields.extend(_relevant_fields(df, model))
+        else:
+            _test_has_columns(df, fields)
+        objs = [obj for chunk in _write_frame(df, model, fields, **options)
+                for obj in chunk]
+        return objs, default_timer() - start
+
+    def write(objs):
+        start = default_timer()
+        with transaction.atomic(using=router.db_for_write(model)):
+            if force_save:
+                for obj in objs:
+                    obj.save()
+            elif mode == 'upsert':
+                names = set(x.name for x in fields) | set(key_names)
+                update_names = [x.name for x in plan.fields
+                                if x.name in names and x.name not in key_names]
+                _upsert(model, objs, key_names, update_names)
+            else:
+                model.objects.bulk_create(objs, batch_size=bulk_create_size)
+        return default_timer() - start
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    async def produce():
+        index = 0
+        while True:
+            # reading the next chunk may be I/O, e.g. pd.read_csv().
+            try:
+                df = await loop.run_in_executor(None, next, chunks, None)
+            except Exception as e:
+                # there's no reading on past it, hand it to the consumer.
+                await queue.put(e)
+                return
+            if df is None:
+                break
+            try:
+                objs, seconds = await loop.run_in_executor(None, prepare, df)
+                await queue.put((index, len(df), objs, seconds, None))
+            except Exception as e:
+                await queue.put((index, len(df), None, 0.0, e))
+            index += 1
+        await queue.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    results = []
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            index, rows, objs, prepare_seconds, error = item
+            write_seconds = 0.0
+            if error is None:
+                try:
+                    write_seconds = await sync_to_async(write)(objs)
+                except Exception as e:
+                    error = e
+            results.append(ChunkResult(index, rows, prepare_seconds,
+                                       write_seconds, error))
+            if error is not None and errors == 'raise':
+                raise error
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+    return results
+
+
+def read_django(queryset, columns=None, index=None, chunksize=None):
+    """
+    Read records from a Django queryset (or model) into a DataFrame.
+
+    The reverse of to_django().
+
+    Parameters
+    ----------
+    queryset : Django queryset or model
+        Records to read, a model reads all of its records.
+    columns: list, default None
+        Names of the fields (or lookups, e.g. 'product__sku') to read.
+        Defaults to all of the model's concrete fields.
+    index: str or list, default None
+        Column(s) to use as the index, they're read even if not in columns.
+        to_django() will read these back out of the index.
+    chunksize: int, default None
+        When set, returns an iterator of DataFrames of this many rows, so that
+        the whole queryset doesn't need to be in memory.
+
+    Note
+    ----
+    Rows are fetched with values_list().iterator(), which uses server-side
+    cursors where the database supports them. Columns get a dtype based on
+    their Django field, e.g. datetime64 for DateTimeFields, in UTC with
+    USE_TZ = True.
+    """
+    if isinstance(queryset, type):
+        queryset = queryset._default_manager.all()
+    model = queryset.model
+    if columns is None:
+        columns = [field.name for field in model._meta.concrete_fields]
+    names = list(columns)
+    if index is not None:
+        index_names = [index] if isinstance(index, str) else list(index)
+        names += [name for name in index_names if name not in names]
+    dtypes = [_django_dtype(model, name) for name in names]
+    rows = queryset.values_list(*names).iterator(
+        chunk_size=chunksize or _read_chunksize)
+    if chunksize is None:
+        return _rows_to_frame(rows, names, dtypes, index)
+    return (_rows_to_frame(chunk, names, dtypes, index)
+            for chunk in _chunks(rows, chunksize))
+
+_read_chunksize = 2000
+
+
+# pandas dtypes for Django field types, with the dtype used if nullable.
+_django_dtypes = {
+    'AutoField': ('int64', 'Int64'),
+    'BigAutoField': ('int64', 'Int64'),
+    'SmallAutoField': ('int64', 'Int64'),
+    'IntegerField': ('int64', 'Int64'),
+    'BigIntegerField': ('int64', 'Int64'),
+    'SmallIntegerField': ('int64', 'Int64'),
+    'PositiveIntegerField': ('int64', 'Int64'),
+    'PositiveBigIntegerField': ('int64', 'Int64'),
+    'PositiveSmallIntegerField': ('int64', 'Int64'),
+    'FloatField': ('float64', 'float64'),
+    'BooleanField': ('bool', 'boolean'),
+    'NullBooleanField': ('boolean', 'boolean'),
+    'DateTimeField': ('datetime64[ns]', 'datetime64[ns]'),
+}
+
+
+def _django_dtype(model, name):
+    """
+    pandas dtype for the model's field name, None if no better than object.
+    """
+    from django.conf import settings
+    from django.core.exceptions import FieldDoesNotExist
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
         return None
+    null = field.null
+    if field.is_relation:
+        field = field.target_field
+    dtypes = _django_dtypes.get(field.get_internal_type())
+    if dtypes is None:
+        return None
+    dtype = dtypes[1] if null else dtypes[0]
+    if dtype == 'datetime64[ns]' and settings.USE_TZ:
+        # the database gives back aware datetimes, in UTC.
+        dtype = 'datetime64[ns, UTC]'
+    return dtype
+
+
+def _rows_to_frame(rows, names, dtypes, index):
+    """
+    Build a DataFrame from value tuples, filling a list per column.
+    """
+    columns = [[] for _ in names]
+    for chunk in _chunks(rows, _read_chunksize):
+        for column, values in zip(columns, zip(*chunk)):
+            column.extend(values)
+    data = {}
+    for name, values, dtype in zip(names, columns, dtypes):
+        try:
+            data[name] = pd.Series(values, dtype=dtype)
+        except (ValueError, TypeError, OverflowError):
+            # e.g. nulls from a join, or dates out of range for datetime64.
+            data[name] = pd.Series(values, dtype=object)
+    df = pd.DataFrame(data, columns=names)
+    if index is not None:
+        df = df.set_index(index)
+    return df
@@ -15,5 +15,6 @@ setup(
         version=version,
         packages=['pandas_love_ponies'],
         license='BSD',
+        python_requires='>=3.8',
         install_requires=requires
 )
@@ -0,0 +1,216 @@
+"""
+Throughput benchmarks for to_django() and validate_for_django().
+
+    ./manage.py plp_benchmark --rows 1000 100000 --output results.json
+    ./manage.py plp_benchmark --rows 1000 100000 --compare results.json
+
+Runs against a throwaway copy of the test database (file-backed sqlite),
+so the numbers include real writes.
+"""
+import contextlib
+import datetime
+import json
+import os
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+import pandas_love_ponies as plp
+from df_to_dj.models import MyModel
+from df_to_dj.models import MyModelWithDates
+
+
+# name => (model, to_django kwargs, whether to load the rows beforehand).
+CASES = OrderedDict([
+    ('bulk_create', (MyModel, {}, False)),
+    ('update', (MyModel, {'update': True}, True)),
+    ('upsert', (MyModel, {'mode': 'upsert'}, True)),
+    ('force_save', (MyModel, {'force_save': True}, False)),
+    ('engine_raw', (MyModel, {'engine': 'raw'}, False)),
+    # partitions written from worker processes, to compare with bulk_create.
+    ('workers_2', (MyModel, {'workers': 2, 'atomic': 'partition'}, False)),
+    ('workers_4', (MyModel, {'workers': 4, 'atomic': 'partition'}, False)),
+    ('utc_to_tz', (MyModelWithDates, {'utc_to_tz': 'Australia/Sydney'},
+                   False)),
+    ('validate', (MyModelWithDates, {'validate': True}, False)),
+    ('validate_for_django', (MyModelWithDates, None, False)),
+    # conversion only, to compare string columns with categoricals.
+    ('convert', (MyModel, {'write_to_db': False}, False)),
+    ('convert_categorical', (MyModel, {'write_to_db': False}, False)),
+    # fixed cost of a call, converting a single row many times over, with
+    # the model's ModelPlan cached, and rebuilt every call.
+    ('fixed_cost', (MyModelWithDates, {'write_to_db': False}, False)),
+    ('fixed_cost_uncached', (MyModelWithDates, {'write_to_db': False},
+                             False)),
+])
+
+# name => (number of calls on the DataFrame's first row, whether to drop the
+# cached ModelPlans before each).
+CALLS = {
+    'fixed_cost': (1000, False),
+    'fixed_cost_uncached': (1000, True),
+}
+
+# name => function of the DataFrame, to run the case on instead.
+FRAMES = {
+    'convert_categorical': lambda df: df.astype({'name2': 'category',
+                                                 'name3': 'category'}),
+}
+
+
+def make_frame(rows):
+    """
+    Synthetic DataFrame with columns for MyModel and MyModelWithDates.
+    """
+    index = np.arange(rows)
+    return pd.DataFrame({
+        'name1': ['name%d' % x for x in index],
+        'name2': np.where(index % 2, 'odd', 'even'),
+        'name3': np.where(index % 10, 'name3', None),
+        'foobar': index,
+        'date': datetime.date(2013, 1, 1),
+        'datetime': pd.date_range('2013-01-01', periods=rows, freq='s'),
+    })
+
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Count queries run on the connection (executemany counts as one).
+    """
+    counter = {'queries': 0}
+
+    def wrapper(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield counter
+
+
+def run_case(name, df, memory):
+    """
+    Time a single benchmark case, returns dict of its results.
+    """
+    model, kwargs, preload = CASES[name]
+    if name in FRAMES:
+        df = FRAMES[name](df)
+    model.objects.all().delete()
+    if preload:
+        plp.to_django(df, model, engine='raw')
+    stats = plp.LoadStats()
+    if kwargs and kwargs.get('workers'):
+        # worker processes' queries aren't seen on this connection.
+        kwargs = dict(kwargs, stats=stats)
+    if memory:
+        tracemalloc.start()
+    # models print on save(), keep that out of the output.
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            with count_queries() as counter:
+                start = time.time()
+                if name in CALLS:
+                    calls, uncached = CALLS[name]
+                    row = df.iloc[:1]
+                    for _ in range(calls):
+                        if uncached:
+                            plp.core._model_plans.clear()
+                        plp.to_django(row, model, **kwargs)
+                elif kwargs is None:
+                    plp.validate_for_django(df, model)
+                else:
+                    plp.to_django(df, model, **kwargs)
+                seconds = time.time() - start
+    rows = CALLS[name][0] if name in CALLS else len(df)
+    result = OrderedDict([
+        ('case', name),
+        ('rows', rows),
+        ('seconds', seconds),
+        ('rows_per_sec', rows / seconds if seconds else None),
+        ('queries', counter['queries'] + stats.queries),
+    ])
+    if name in CALLS:
+        result['us_per_call'] = 1e6 * seconds / rows
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_memory_mb'] = peak / 1e6
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the to_django() write paths on sqlite.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+',
+                            default=[1000, 10000, 100000],
+                            help='DataFrame sizes to benchmark.')
+        parser.add_argument('--cases', nargs='+', choices=list(CASES),
+                            default=list(CASES))
+        parser.add_argument('--output',
+                            help='Write results as JSON to this file.')
+        parser.add_argument('--compare',
+                            help='JSON results of an earlier run, to show '
+                                 'the change in rows/sec against.')
+        parser.add_argument('--skip-memory', action='store_true',
+                            help="Don't measure peak memory, which takes a "
+                                 "second run of each case.")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = {(x['case'], x['rows']): x
+                            for x in json.load(f)['results']}
+        else:
+            previous = {}
+        self.stdout.write('%-20s %10s %12s %10s %10s %8s' % (
+            'case', 'rows', 'rows/sec', 'queries', 'peak MB', 'change'))
+        for result in results:
+            before = previous.get((result['case'], result['rows']))
+            if before and before['rows_per_sec'] and result['rows_per_sec']:
+                change = '%+.0f%%' % (
+                    100 * (result['rows_per_sec'] / before['rows_per_sec'] - 1))
+            else:
+                change = ''
+            self.stdout.write('%-20s %10d %12.0f %10d %10s %8s' % (
+                result['case'], result['rows'], result['rows_per_sec'] or 0,
+                result['queries'],
+                '%.1f' % result['peak_memory_mb']
+                if 'peak_memory_mb' in result else '', change))
+        for result in results:
+            if 'us_per_call' in result:
+                self.stdout.write('%s: %.0f us per call' % (
+                    result['case'], result['us_per_call']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'version': plp.__version__,
+                    'pandas': pd.__version__,
+                    'database': connection.vendor,
+                    'results': results,
+                }, f, indent=2)
+
+    def run(self, options):
+        results = []
+        for rows in options['rows']:
+            df = make_frame(rows)
+            for name in options['cases']:
+                result = run_case(name, df, memory=False)
+                if not options['skip_memory']:
+                    memory = run_case(name, df, memory=True)
+                    result['peak_memory_mb'] = memory['peak_memory_mb']
+                results.append(result)
+        return results
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
@@ -11,7 +13,7 @@ class MyModel(models.Model):
         return "%s, %s, %s => %s" % (self.name1, self.name2, self.name3, self.foobar)
 
     def save(self, *args, **kwargs):
-        print 'SAVE CALLED', '^' * 22
+        print('SAVE CALLED', '^' * 22)
         super(MyModel, self).save(*args, **kwargs)
 
     class Meta:
@@ -30,8 +32,40 @@ class MyModelWithDates(models.Model):
         return "%s, %s, %s => %s" % (self.name1, self.name2, self.name3, self.foobar)
 
     def save(self, *args, **kwargs):
-        print 'SAVE CALLED', '^' * 22
+        print('SAVE CALLED', '^' * 22)
         super(MyModel, self).save(*args, **kwargs)
 
     class Meta:
         unique_together = ('name1', 'name2',)
+
+
+class MyModelWithChoices(models.Model):
+    status = models.CharField(max_length=4,
+                              choices=(('new', 'New'), ('done', 'Done')))
+    count = models.PositiveSmallIntegerField()
+    ratio = models.FloatField(null=True)
+
+
+class Product(models.Model):
+    sku = models.CharField(max_length=32, unique=True)
+
+
+class Sale(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+
+
+class Token(models.Model):
+    name = models.CharField(max_length=32)
+    token = models.UUIDField(default=uuid.uuid4, unique=True)
+
+    class Meta:
+        unique_together = ('name',)
+
+
+class Price(models.Model):
+    code = models.CharField(max_length=32)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+
+    class Meta:
+        unique_together = ('code',)
@@ -5,13 +5,33 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from asgiref.sync import async_to_sync
+import asyncio
+from collections import OrderedDict
+from django.db import IntegrityError
+from django.db import connection
+from django.db import OperationalError
+from django.db import transaction
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
 import datetime
+import decimal
+import os
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
 import pandas as pd
 import numpy as np
 import pandas_love_ponies as plp
-from models import MyModel
-from models import MyModelWithDates
+from .models import MyModel
+from .models import MyModelWithDates
+from .models import MyModelWithChoices
+from .models import Price
+from .models import Product
+from .models import Sale
+from .models import Token
 
 
 # monkey patch.
@@ -142,6 +162,43 @@ class PLPValidateTest(TestCase):
         self.assertTrue(df.validate_for_django(MyModelWithDates))
 
 
+    def test_report(self):
+        df = pd.DataFrame({
+            'status': ['new', 'done', 'bad', 'toolong', None],
+            'count': [1, -1, 2.5, 'x', 70000],
+            'ratio': [0.5, None, 'y', 1, 2],
+        }, index=list('abcde'))
+        problems = plp.validate_for_django(df, MyModelWithChoices,
+                                           report=True)
+        self.assertEqual({
+            ('status', 'null'): ['e'],
+            ('count', 'dtype'): ['c', 'd'],
+            ('ratio', 'dtype'): ['c'],
+            ('count', 'overflow'): ['b'],
+            ('status', 'max_length'): ['d'],
+            ('status', 'choices'): ['c', 'd'],
+        }, {key: list(rows) for key, rows in problems.items()})
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          plp.validate_for_django, df, MyModelWithChoices)
+        # count and ratio are converted once each, for both numeric rules.
+        with mock.patch('pandas.to_numeric',
+                        side_effect=pd.to_numeric) as to_numeric:
+            plp.validate_for_django(df, MyModelWithChoices, report=True)
+        self.assertEqual(2, to_numeric.call_count)
+
+        df = pd.DataFrame(self.data)
+        df['date'] = [datetime.date(2013, 1, 1), '2013-01-02', None]
+        df['foobar'] = 1
+        problems = plp.validate_for_django(df, MyModelWithDates, report=True)
+        self.assertEqual([1], list(problems[('date', 'date_strings')]))
+        self.assertEqual([1, 2], list(problems[('name2', 'null')]))
+        self.assertEqual([2], list(problems[('date', 'null')]))
+
+        self.assertEqual({}, plp.validate_for_django(df.iloc[:0],
+                                                     MyModelWithDates,
+                                                     report=True))
+
+
 class PLPTest(TestCase):
     def setUp(self):
         self.data = {
@@ -161,17 +218,17 @@ class PLPTest(TestCase):
         df = pd.DataFrame(self.data)
         df.index.name = 'foobar'
 
-        print 'first call to .to_django()', '-' * 44
-        print df.head()
+        print('first call to .to_django()', '-' * 44)
+        print(df.head())
         df.to_django(MyModel)
-        print MyModel.objects.all().count()
+        print(MyModel.objects.all().count())
         for mm in MyModel.objects.all():
-            print mm
+            print(mm)
 
         self.assertEqual(len(df), MyModel.objects.all().count())
 
-        print 'second call to .to_django()', '-' * 44
-        print df.head()
+        print('second call to .to_django()', '-' * 44)
+        print(df.head())
         df.to_django(MyModel, update=True)
 
         self.assertEqual(len(df), MyModel.objects.all().count())
@@ -179,12 +236,12 @@ class PLPTest(TestCase):
         df = pd.DataFrame(df.groupby(['name1', 'name2']).b.sum())
         df['foobar'] = 3
         MyModel.objects.all().delete()
-        print 'third call to .to_django()', '-' * 44
-        print df.head()
+        print('third call to .to_django()', '-' * 44)
+        print(df.head())
         df.to_django(MyModel)
-        print MyModel.objects.all().count()
+        print(MyModel.objects.all().count())
         for mm in MyModel.objects.all():
-            print mm
+            print(mm)
 
     def test_kwarg_write_to_db(self):
         df = pd.DataFrame(self.data)
@@ -218,3 +275,783 @@ class PLPTest(TestCase):
         self.assertIsNotNone(objs)
         self.assertIsInstance(objs, list)
         self.assertEqual(len(objs), len(df))
+
+    def test_null_handling(self):
+        df = pd.DataFrame(self.data)
+        df.index.name = 'foobar'
+
+        objs = df.to_django(MyModel, write_to_db=False, return_objects=True)
+        # default used for name1, empty string for name2, None for name3.
+        self.assertEqual(['a', 'b', 'LEX'], [x.name1 for x in objs])
+        self.assertEqual(['a', '', ''], [x.name2 for x in objs])
+        self.assertEqual(['a', 'b', None], [x.name3 for x in objs])
+        self.assertEqual([0, 1, 2], [x.foobar for x in objs])
+
+    def test_update_batched(self):
+        df = pd.DataFrame({
+            'name1': list('abcdef'),
+            'name2': 'x',
+            'foobar': range(6),
+        })
+        df.iloc[:3].to_django(MyModel)
+
+        df['foobar'] = 10
+        df['name3'] = ['updated'] + [None] * 5
+        # per chunk: one select of existing, then one update (first chunk)
+        # or one insert (second chunk), plus a savepoint and its release.
+        with self.assertNumQueries(8):
+            df.to_django(MyModel, update=True, bulk_create_size=3)
+        self.assertEqual(6, MyModel.objects.count())
+        self.assertEqual(6, MyModel.objects.filter(foobar=10).count())
+        self.assertEqual('updated', MyModel.objects.get(name1='a').name3)
+
+    def test_update_only_matched(self):
+        df = pd.DataFrame({
+            'name1': ['a', 'b', 'a'],
+            'name2': ['x', 'y', 'y'],
+            'foobar': range(3),
+        })
+        df.to_django(MyModel)
+        MyModel.objects.filter(name1='a', name2='y').update(foobar=20)
+
+        # (a, y) is in the cross product of the keys, but not in the frame.
+        df = df.iloc[:2].copy()
+        df['foobar'] = 10
+        plan = plp.core._model_plan(MyModel)
+        chunk = [((10,), ('a', 'x')), ((10,), ('b', 'y'))]
+        new_objs, existing_objs, objs = plp.core._update_objects(
+            MyModel, ['foobar'], plan.key_fields, chunk, plp.core._no_stats)
+        self.assertEqual([], new_objs)
+        self.assertEqual([('a', 'x'), ('b', 'y')], [
+            (x.name1, x.name2) for x in existing_objs])
+
+        df.to_django(MyModel, update=True)
+        self.assertEqual([('a', 'x', 10), ('a', 'y', 20), ('b', 'y', 10)],
+                         list(MyModel.objects.order_by(
+                             'name1', 'name2').values_list(
+                                 'name1', 'name2', 'foobar')))
+
+    def test_mode_upsert(self):
+        df = pd.DataFrame({
+            'name1': list('abcdef'),
+            'name2': 'x',
+            'foobar': range(6),
+        })
+        df.iloc[:3].to_django(MyModel)
+        ids = list(MyModel.objects.order_by('id').values_list('id', flat=True))
+
+        df['foobar'] = 10
+        # one INSERT ... ON CONFLICT DO UPDATE per chunk, plus a savepoint and
+        # its release.
+        with self.assertNumQueries(6):
+            df.to_django(MyModel, mode='upsert', bulk_create_size=3)
+        self.assertEqual(6, MyModel.objects.count())
+        self.assertEqual(6, MyModel.objects.filter(foobar=10).count())
+        self.assertEqual(ids, list(MyModel.objects.filter(
+            name1__in=list('abc')).order_by('id').values_list('id', flat=True)))
+
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          df.to_django, MyModel, mode='upsert', update=True)
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          df.to_django, MyModel, mode='bogus')
+
+    def test_mode_upsert_without_conflict_target(self):
+        # e.g. MySQL, where Django refuses unique_fields.
+        df = pd.DataFrame({'name1': ['a'], 'name2': 'x', 'foobar': [1]})
+        with mock.patch.object(connection.features,
+                               'supports_update_conflicts_with_target',
+                               False):
+            with mock.patch('django.db.models.query.QuerySet.bulk_create'
+                            ) as bulk_create:
+                df.to_django(MyModel, mode='upsert')
+        self.assertIsNone(bulk_create.call_args[1]['unique_fields'])
+        self.assertTrue(bulk_create.call_args[1]['update_conflicts'])
+
+    def test_mode_merge_via_staging(self):
+        df = pd.DataFrame({
+            'name1': list('abcdef'),
+            'name2': 'x',
+            'name3': 'y',
+            'foobar': range(6),
+        })
+        df.iloc[:3].to_django(MyModel)
+        ids = list(MyModel.objects.order_by('id').values_list('id', flat=True))
+
+        df = df.drop(columns='name3')
+        df['foobar'] = 10
+        # drop/create the staging table, an executemany per chunk, the
+        # UPDATE, INSERT and drop, in a savepoint.
+        with self.assertNumQueries(9):
+            df.to_django(MyModel, mode='merge_via_staging',
+                         bulk_create_size=3)
+        self.assertEqual(6, MyModel.objects.count())
+        self.assertEqual(6, MyModel.objects.filter(foobar=10).count())
+        self.assertEqual(ids, list(MyModel.objects.filter(
+            name1__in=list('abc')).order_by('id').values_list('id', flat=True)))
+        self.assertEqual(['y', 'y', 'y', None, None, None], list(
+            MyModel.objects.order_by('name1').values_list('name3', flat=True)))
+
+        df = pd.DataFrame({'id': [ids[0]], 'status': 'done', 'count': 1})
+        MyModelWithChoices.objects.create(id=ids[0], status='new', count=0)
+        df.to_django(MyModelWithChoices, mode='merge_via_staging')
+        self.assertEqual([('done', 1)], list(
+            MyModelWithChoices.objects.values_list('status', 'count')))
+
+        # new records get a callable default called for each row.
+        pd.DataFrame({'name': list('abc')}).to_django(
+            Token, mode='merge_via_staging')
+        self.assertEqual(3, len(set(Token.objects.values_list('token',
+                                                              flat=True))))
+
+    def test_merge_via_staging_drop(self):
+        # a table of the database with the staging table's name is left be.
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE plp_staging_df_to_dj_mymodel '
+                           '(foobar integer)')
+        df = pd.DataFrame({'name1': list('ab'), 'name2': 'x', 'foobar': 1})
+        df.to_django(MyModel, mode='merge_via_staging')
+        self.assertEqual(2, MyModel.objects.count())
+        self.assertIn('plp_staging_df_to_dj_mymodel',
+                      connection.introspection.table_names())
+
+        for vendor, sql in [
+                ('mysql', 'DROP TEMPORARY TABLE IF EXISTS staging'),
+                ('postgresql', 'DROP TABLE IF EXISTS pg_temp.staging'),
+                ('sqlite', 'DROP TABLE IF EXISTS temp.staging')]:
+            self.assertEqual(sql, plp.core._drop_staging_sql(
+                mock.Mock(vendor=vendor), 'staging', if_exists=True))
+
+    def test_to_django_many(self):
+        df = pd.DataFrame({
+            'sku': ['a', 'b', 'a', 'c', 'b'],
+            'quantity': range(5),
+        })
+        # a bulk insert per model, in a savepoint.
+        with self.assertNumQueries(4):
+            created = plp.to_django_many(df, OrderedDict([
+                (Product, ['sku']), (Sale, ['quantity'])]))
+        self.assertEqual(3, len(created[Product]))
+        self.assertEqual(5, len(created[Sale]))
+        self.assertEqual(['a', 'b', 'a', 'c', 'b'], [
+            Sale.objects.get(pk=pk).product.sku for pk in created[Sale]])
+
+        df = pd.DataFrame({'code': ['d', 'd'], 'quantity': [1, 2]})
+        plp.to_django_many(df, OrderedDict([
+            (Product, {'code': 'sku'}), (Sale, ['quantity'])]),
+            relations={Sale: {'product': Product}})
+        self.assertEqual([1, 2], list(Sale.objects.filter(
+            product__sku='d').order_by('quantity').values_list(
+                'quantity', flat=True)))
+
+        self.assertRaises(plp.PandasLovesPoniesException, plp.to_django_many,
+                          df, OrderedDict([(Sale, ['quantity']),
+                                           (Product, {'code': 'sku'})]),
+                          relations={Sale: {'product': Product}})
+        # a parent that isn't one of the models.
+        self.assertRaises(plp.PandasLovesPoniesException, plp.to_django_many,
+                          df, OrderedDict([(Sale, ['quantity'])]),
+                          relations={Sale: {'product': Product}})
+
+    def test_engine_raw(self):
+        df = pd.DataFrame({
+            'name1': ['a', 'b', np.nan, 'd', 'e', 'f'],
+            'name2': 'x',
+            'foobar': range(6),
+        })
+        # one executemany per chunk, plus a savepoint and its release.
+        with self.assertNumQueries(6):
+            objs = df.to_django(MyModel, engine='raw', bulk_create_size=3)
+        self.assertIsNone(objs)
+        self.assertEqual(6, MyModel.objects.count())
+        mm = MyModel.objects.get(foobar=2)
+        self.assertEqual('LEX', mm.name1)
+        self.assertEqual('x', mm.name2)
+        self.assertIsNone(mm.name3)
+
+        df.to_django(MyModel, engine='raw', write_to_db=False)
+        self.assertEqual(6, MyModel.objects.count())
+
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          df.to_django, MyModel, engine='raw', update=True)
+
+        # a callable default is called for each row.
+        pd.DataFrame({'name': list('abc')}).to_django(Token, engine='raw')
+        self.assertEqual(3, len(set(Token.objects.values_list('token',
+                                                              flat=True))))
+
+    def test_iterable_of_frames(self):
+        df = pd.DataFrame({
+            'name1': list('abcdef'),
+            'name2': 'x',
+            'foobar': range(6),
+        })
+        frames = (df.iloc[i:i + 2] for i in range(0, len(df), 2))
+        objs = plp.to_django(frames, MyModel, return_objects=True)
+        self.assertEqual(6, len(objs))
+        self.assertEqual(6, MyModel.objects.count())
+
+        # later chunks must have the same columns as the first.
+        frames = [df.iloc[:3], df.iloc[3:].drop('foobar', axis=1)]
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          plp.to_django, frames, MyModel, write_to_db=False)
+
+    def test_iterable_of_frames_memory(self):
+        def frames(n):
+            for i in range(n):
+                yield pd.DataFrame({
+                    'name1': ['name%d' % x for x in range(2000)],
+                    'name2': 'x',
+                    'foobar': range(2000),
+                })
+
+        def peak_memory(n):
+            tracemalloc.start()
+            plp.to_django(frames(n), MyModel, write_to_db=False)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+
+        # memory is bounded by the chunk size, not the number of chunks.
+        peak_memory(1)
+        self.assertLess(peak_memory(20), 1.5 * peak_memory(2))
+
+    def test_dataframe_not_edited(self):
+        df = pd.DataFrame(self.data)
+        df.index.name = 'foobar'
+        df['unused'] = 1.5
+        expected = df.copy()
+
+        objs = df.to_django(MyModel, return_objects=True)
+        self.assertEqual([0, 1, 2], [x.foobar for x in objs])
+        pd.testing.assert_frame_equal(expected, df)
+
+    def test_utc_to_tz(self):
+        df = pd.DataFrame({
+            'name2': list('ab'),
+            'foobar': range(2),
+            'date': [datetime.date(2013, 1, 1)] * 2,
+            'datetime': pd.DatetimeIndex([
+                datetime.datetime(2013, 1, 1),
+                datetime.datetime(2013, 7, 1, 12),
+            ]),
+        })
+        expected = [
+            datetime.datetime(2013, 1, 1, 11),
+            datetime.datetime(2013, 7, 1, 22),
+        ]
+        objs = df.to_django(MyModelWithDates, utc_to_tz='Australia/Sydney',
+                            write_to_db=False, return_objects=True)
+        self.assertEqual(expected, [x.datetime for x in objs])
+        self.assertIsNone(objs[0].datetime.tzinfo)
+
+        objs = df.to_django(MyModelWithDates, utc_to_tz='Australia/Sydney',
+                            keep_tzinfo=True, write_to_db=False,
+                            return_objects=True)
+        self.assertEqual(expected,
+                         [x.datetime.replace(tzinfo=None) for x in objs])
+        self.assertIsNotNone(objs[0].datetime.tzinfo)
+
+        # falls back to converting each value, if can't be datetime64.
+        df['datetime'] = [datetime.datetime(2013, 1, 1),
+                          datetime.datetime(3000, 1, 1)]
+        objs = df.to_django(MyModelWithDates, utc_to_tz='Australia/Sydney',
+                            write_to_db=False, return_objects=True)
+        self.assertEqual([datetime.datetime(2013, 1, 1, 11),
+                          datetime.datetime(3000, 1, 1, 11)],
+                         [x.datetime for x in objs])
+
+    def test_model_plan_cached(self):
+        plan = plp.core._model_plan(MyModelWithDates)
+        self.assertIs(plan, plp.core._model_plan(MyModelWithDates))
+        self.assertEqual(['date', 'datetime'], plan.date_fields)
+        self.assertEqual(['datetime'], plan.datetime_fields)
+        self.assertEqual(128, plan.max_lengths['name1'])
+        self.assertEqual(['name1', 'name2'],
+                         [x.name for x in plan.key_fields])
+
+    def test_stats(self):
+        df = pd.DataFrame({
+            'name1': list('abcdef'),
+            'name2': 'x',
+            'name3': None,
+            'foobar': range(6),
+        })
+        progress = []
+        stats = plp.LoadStats()
+        df.to_django(MyModel, bulk_create_size=4, validate=True, stats=stats,
+                     progress=lambda x: progress.append(x.rows))
+        self.assertEqual(6, stats.rows)
+        self.assertEqual(2, stats.chunks)
+        self.assertEqual([4, 6], progress)
+        # per chunk: insert, savepoint and its release.
+        self.assertEqual(6, stats.queries)
+        self.assertGreater(stats.bytes_sent, 0)
+        self.assertEqual(['validate', 'prepare', 'fetch', 'build', 'write'],
+                         list(stats.phases))
+        self.assertGreater(stats.phases['write'], 0)
+        self.assertGreaterEqual(stats.seconds, sum(stats.phases.values()))
+
+        # callable gets the stats at the end.
+        finished = []
+        df.to_django(MyModel, mode='upsert', stats=finished.append)
+        self.assertEqual(1, len(finished))
+        self.assertEqual(6, finished[0].rows)
+
+
+    def test_fk_lookups(self):
+        plp.clear_fk_cache()
+        Product.objects.create(sku='A')
+        df = pd.DataFrame({
+            'product': ['A', 'B', 'A', 'C'],
+            'quantity': range(4),
+        })
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          df.to_django, Sale, fk_lookups={'product': 'sku'})
+        self.assertEqual(0, Sale.objects.count())
+
+        # a failed chunk rolls back the records it created, their ids
+        # mustn't be cached.
+        bad = df.assign(quantity=[0, 1, None, 3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertRaises(ValueError, bad.to_django, Sale,
+                              fk_lookups={'product': 'sku'}, fk_create=True)
+        self.assertEqual(1, Product.objects.count())
+        self.assertEqual({}, dict(plp.core._fk_cache))
+
+        # ids are cached once committed.
+        with self.captureOnCommitCallbacks(execute=True):
+            df.to_django(Sale, fk_lookups={'product': 'sku'},
+                         fk_create=True)
+        self.assertEqual(3, Product.objects.count())
+        self.assertEqual(['A', 'B', 'A', 'C'], [
+            x.product.sku for x in Sale.objects.order_by('quantity')])
+
+        # all the keys are cached now, only the insert (and savepoint).
+        with self.assertNumQueries(3):
+            df.to_django(Sale, fk_lookups={'product': 'sku'})
+        self.assertEqual(8, Sale.objects.count())
+        plp.clear_fk_cache()
+
+
+    def test_mode_sync(self):
+        df = pd.DataFrame({
+            'name1': list('abcd'),
+            'name2': 'x',
+            'name3': ['a', None, 'c', 'd'],
+            'foobar': range(4),
+            'date': [datetime.date(2013, 1, x) for x in range(1, 5)],
+            'datetime': pd.date_range('2013-01-01', periods=4, freq='h'),
+        })
+        counts = df.to_django(MyModelWithDates, mode='sync')
+        self.assertEqual({'created': 4, 'updated': 0, 'unchanged': 0,
+                          'deleted': 0}, dict(counts))
+
+        counts = df.to_django(MyModelWithDates, mode='sync')
+        self.assertEqual({'created': 0, 'updated': 0, 'unchanged': 4,
+                          'deleted': 0}, dict(counts))
+
+        df = df.iloc[1:].copy()
+        df['foobar'] = [1, 20, 3]
+        df.loc[len(df) + 1] = ['e', 'x', None, 4, datetime.date(2013, 1, 5),
+                               pd.Timestamp('2013-01-01 04:00')]
+        # b unchanged, c changed, d unchanged, e new and a deleted.
+        counts = df.to_django(MyModelWithDates, mode='sync',
+                              sync_delete=True)
+        self.assertEqual({'created': 1, 'updated': 1, 'unchanged': 2,
+                          'deleted': 1}, dict(counts))
+        self.assertEqual([('b', 1), ('c', 20), ('d', 3), ('e', 4)], list(
+            MyModelWithDates.objects.order_by('name1').values_list(
+                'name1', 'foobar')))
+
+    def test_mode_sync_decimal(self):
+        df = pd.DataFrame({'code': list('abc'), 'price': [1.5, 0.1, None]})
+        df.to_django(Price, mode='sync')
+        # floats compare equal to the Decimals read back.
+        counts = df.to_django(Price, mode='sync')
+        self.assertEqual({'created': 0, 'updated': 0, 'unchanged': 3,
+                          'deleted': 0}, dict(counts))
+        df['price'] = [decimal.Decimal('1.50'), decimal.Decimal('0.2'), None]
+        counts = df.to_django(Price, mode='sync')
+        self.assertEqual({'created': 0, 'updated': 1, 'unchanged': 2,
+                          'deleted': 0}, dict(counts))
+
+
+    def test_python_types(self):
+        df = pd.DataFrame({
+            'name1': list('ab'),
+            'name2': 'x',
+            'name3': None,
+            'foobar': [1.0, 2.0],
+            'date': pd.to_datetime(['2013-01-01', '2013-01-02']),
+            'datetime': pd.date_range('2013-01-01', periods=2, freq='h'),
+        })
+        objs = df.to_django(MyModelWithDates, write_to_db=False,
+                            return_objects=True)
+        self.assertEqual([1, 2], [obj.foobar for obj in objs])
+        self.assertEqual({int}, set(type(obj.foobar) for obj in objs))
+        self.assertEqual({datetime.date},
+                         set(type(obj.date) for obj in objs))
+        self.assertEqual({datetime.datetime},
+                         set(type(obj.datetime) for obj in objs))
+
+    def test_categorical(self):
+        df = pd.DataFrame({
+            'name1': pd.Categorical(['a', None, 'a', 'b']),
+            'name2': pd.Categorical(['x', 'x', None, 'y']),
+            'name3': pd.Categorical(['a', None, 'a', None]),
+            'foobar': range(4),
+        })
+        objs = df.to_django(MyModel, write_to_db=False, return_objects=True)
+        self.assertEqual(['a', 'LEX', 'a', 'b'], [x.name1 for x in objs])
+        self.assertEqual(['x', 'x', '', 'y'], [x.name2 for x in objs])
+        self.assertEqual(['a', None, 'a', None], [x.name3 for x in objs])
+        # distinct values are shared, not a string per row.
+        self.assertIs(objs[0].name1, objs[2].name1)
+
+    def test_checkpoint(self):
+        for checkpoint in [os.path.join(tempfile.mkdtemp(), 'load.json'),
+                           'plp_checkpoint']:
+            Product.objects.all().delete()
+            # 'g' is already there, so the load fails at the 4th chunk.
+            Product.objects.create(sku='g')
+            df = pd.DataFrame({'sku': list('abcdefghij')})
+            # the file is written once the test's transaction "commits".
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(IntegrityError):
+                    df.to_django(Product, commit_every=2,
+                                 checkpoint=checkpoint, load_id='products')
+            self.assertEqual(7, Product.objects.count())
+
+            Product.objects.filter(sku='g').delete()
+            # only the last two chunks are written, in a savepoint each, the
+            # table also takes creating, reading and writing progress.
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(6 if checkpoint.endswith('.json')
+                                           else 12):
+                    df.to_django(Product, commit_every=2,
+                                 checkpoint=checkpoint, load_id='products')
+            self.assertEqual(list('abcdefghij'), list(
+                Product.objects.order_by('sku').values_list('sku',
+                                                            flat=True)))
+
+            # a finished load is skipped, a changed DataFrame refused.
+            with self.assertNumQueries(0 if checkpoint.endswith('.json')
+                                       else 2):
+                df.to_django(Product, commit_every=2, checkpoint=checkpoint,
+                             load_id='products')
+            df.loc[0, 'sku'] = 'z'
+            self.assertRaises(plp.PandasLovesPoniesException, df.to_django,
+                              Product, checkpoint=checkpoint,
+                              load_id='products')
+            # a resumed load never sees the skipped rows' keys.
+            self.assertRaises(plp.PandasLovesPoniesException, df.to_django,
+                              Product, mode='sync', sync_delete=True,
+                              checkpoint=checkpoint, load_id='sync')
+
+    def test_on_duplicate(self):
+        df = pd.DataFrame({
+            'name1': list('abab'),
+            'name2': 'x',
+            'name3': ['a', 'b', None, 'd'],
+            'foobar': range(4),
+        })
+        self.assertRaises(IntegrityError, df.to_django, MyModel)
+        self.assertRaises(plp.PandasLovesPoniesException, df.to_django,
+                          MyModel, on_duplicate='error')
+        self.assertEqual(0, MyModel.objects.count())
+
+        stats = plp.LoadStats()
+        df.to_django(MyModel, on_duplicate='first', stats=stats)
+        self.assertEqual(2, stats.duplicates)
+        self.assertEqual([('a', 0), ('b', 1)], list(MyModel.objects.order_by(
+            'name1').values_list('name1', 'foobar')))
+
+        df['name2'] = 'y'
+        df.to_django(MyModel, on_duplicate='last')
+        self.assertEqual([('a', 2), ('b', 3)], list(MyModel.objects.filter(
+            name2='y').order_by('name1').values_list('name1', 'foobar')))
+
+        df['name2'] = 'z'
+        df.to_django(MyModel, on_duplicate='aggregate')
+        self.assertEqual([('a', 'a', 2), ('b', 'd', 4)], list(
+            MyModel.objects.filter(name2='z').order_by('name1').values_list(
+                'name1', 'name3', 'foobar')))
+
+        df['name2'] = 'w'
+        df.to_django(MyModel, on_duplicate={'foobar': 'max'})
+        self.assertEqual([('a', 2), ('b', 3)], list(MyModel.objects.filter(
+            name2='w').order_by('name1').values_list('name1', 'foobar')))
+
+        # fields in the index are aggregated as the columns are.
+        df['name2'] = 'v'
+        df.set_index('name3').to_django(MyModel, on_duplicate='aggregate')
+        self.assertEqual([('a', 'a', 2), ('b', 'd', 4)], list(
+            MyModel.objects.filter(name2='v').order_by('name1').values_list(
+                'name1', 'name3', 'foobar')))
+
+    def test_bulk_create_size_auto(self):
+        df = pd.DataFrame({
+            'name1': ['name%d' % x for x in range(2000)],
+            'name2': 'x',
+            'name3': None,
+            'foobar': range(2000),
+        })
+        stats = plp.LoadStats()
+        df.to_django(MyModel, bulk_create_size='auto', stats=stats)
+        self.assertEqual(2000, MyModel.objects.count())
+        self.assertEqual(2000, sum(stats.batch_sizes))
+        self.assertEqual(len(stats.batch_sizes), stats.chunks)
+        # sqlite takes 999 parameters per query, 4 fields a row.
+        self.assertEqual(249, stats.batch_sizes[0])
+
+        # each batch is timed once its transaction has been committed.
+        observe = plp.core._AutoBatchSize.observe
+        depths = []
+
+        def tracking_observe(batch_size, rows, seconds):
+            depths.append(len(connection.savepoint_ids))
+            return observe(batch_size, rows, seconds)
+
+        with mock.patch.object(plp.core._AutoBatchSize, 'observe',
+                               tracking_observe):
+            df.assign(name2='y').to_django(MyModel, bulk_create_size='auto')
+        self.assertTrue(depths)
+        self.assertEqual({len(connection.savepoint_ids)}, set(depths))
+
+        # the raw engine's chunks are sized the same way.
+        stats = plp.LoadStats()
+        df.assign(name2='z').to_django(MyModel, bulk_create_size='auto',
+                                       engine='raw', stats=stats)
+        self.assertEqual(2000, sum(stats.batch_sizes))
+        self.assertEqual(len(stats.batch_sizes), stats.chunks)
+
+    def test_returning(self):
+        df = pd.DataFrame({
+            'name1': list('abcde'),
+            'name2': 'x',
+            'name3': ['a', None, 'c', None, 'e'],
+            'foobar': range(5),
+        })
+        pks = df.to_django(MyModel, returning='pks')
+        self.assertIsInstance(pks, np.ndarray)
+        self.assertEqual(list(MyModel.objects.order_by('foobar').values_list(
+            'pk', flat=True)), pks.tolist())
+
+        df['name2'] = 'y'
+        load = df.to_django(MyModel, returning='iter', bulk_create_size=2)
+        # nothing is written until iterated over.
+        self.assertEqual(0, MyModel.objects.filter(name2='y').count())
+        chunks = list(load)
+        self.assertEqual([2, 2, 1], [len(objs) for objs in chunks])
+        self.assertEqual(list('abcde'),
+                         [obj.name1 for objs in chunks for obj in objs])
+        self.assertEqual(5, MyModel.objects.filter(name2='y').count())
+
+        self.assertRaises(plp.PandasLovesPoniesException, df.to_django,
+                          MyModel, returning='pks', return_objects=True)
+
+
+class PLPAsyncTest(TestCase):
+    def test_ato_django(self):
+        df = pd.DataFrame({
+            'name1': list('abcde'),
+            'name2': 'x',
+            'name3': ['a', None, 'c', None, 'e'],
+            'foobar': range(5),
+        })
+        results = async_to_sync(plp.ato_django)(df, MyModel, chunksize=2)
+        self.assertEqual([0, 1, 2], [x.index for x in results])
+        self.assertEqual([2, 2, 1], [x.rows for x in results])
+        self.assertEqual([None] * 3, [x.error for x in results])
+        self.assertEqual(list('abcde'), list(
+            MyModel.objects.order_by('foobar').values_list('name1', flat=True)))
+
+    def test_ato_django_errors(self):
+        Product.objects.create(sku='c')
+        df = pd.DataFrame({'sku': list('abcd')})
+        with self.assertRaises(IntegrityError):
+            async_to_sync(plp.ato_django)(df, Product, chunksize=2)
+        self.assertEqual(['a', 'b', 'c'], list(
+            Product.objects.order_by('sku').values_list('sku', flat=True)))
+
+        df = pd.DataFrame({'sku': list('efcg')})
+        results = async_to_sync(plp.ato_django)(df, Product, chunksize=1,
+                                                errors='collect')
+        self.assertEqual([None, None, IntegrityError, None],
+                         [x.error and type(x.error) for x in results])
+        self.assertEqual(list('abcefg'), list(
+            Product.objects.order_by('sku').values_list('sku', flat=True)))
+
+    def test_ato_django_read_error(self):
+        def frames():
+            yield pd.DataFrame({'sku': list('ab')})
+            raise ValueError('bad file')
+
+        async def load():
+            return await asyncio.wait_for(
+                plp.ato_django(frames(), Product, errors='collect'), 5)
+
+        start = time.time()
+        with self.assertRaises(ValueError):
+            async_to_sync(load)()
+        # raised straight away, not once waiting on the producer timed out.
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(['a', 'b'], list(
+            Product.objects.order_by('sku').values_list('sku', flat=True)))
+
+
+class PLPReadTest(TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'name1': list('abcde'),
+            'name2': 'x',
+            'name3': ['a', None, 'c', None, 'e'],
+            'foobar': range(5),
+            'date': [datetime.date(2013, 1, x) for x in range(1, 6)],
+            'datetime': pd.date_range('2013-01-01', periods=5, freq='h'),
+        })
+        self.df.to_django(MyModelWithDates)
+
+    def test_read_django(self):
+        df = plp.read_django(MyModelWithDates)
+        self.assertEqual(['id', 'name1', 'name2', 'name3', 'foobar', 'date',
+                          'datetime'], list(df.columns))
+        self.assertEqual(5, len(df))
+        self.assertEqual('int64', df['foobar'].dtype)
+        self.assertEqual('datetime64[ns]', df['datetime'].dtype)
+        self.assertEqual(self.df['name3'].tolist(), df['name3'].tolist())
+        self.assertEqual(self.df['datetime'].tolist(), df['datetime'].tolist())
+
+        # round-trips through to_django, with the index.
+        df = plp.read_django(MyModelWithDates.objects.filter(foobar__gte=3),
+                             columns=['name2', 'foobar'],
+                             index=['name1', 'datetime'])
+        self.assertEqual(['name1', 'datetime'], list(df.index.names))
+        self.assertEqual(['name2', 'foobar'], list(df.columns))
+        self.assertEqual([3, 4], df['foobar'].tolist())
+        objs = df.to_django(MyModelWithDates, write_to_db=False,
+                            return_objects=True)
+        self.assertEqual(['d', 'e'], [x.name1 for x in objs])
+
+    @override_settings(USE_TZ=True)
+    def test_read_django_use_tz(self):
+        # stored naive, so read back as UTC.
+        df = plp.read_django(MyModelWithDates)
+        self.assertEqual('datetime64[ns, UTC]', df['datetime'].dtype)
+        self.assertEqual(self.df['datetime'].dt.tz_localize('UTC').tolist(),
+                         df['datetime'].tolist())
+
+        # round-trips unchanged through mode='sync'.
+        counts = df.drop(columns='id').to_django(MyModelWithDates,
+                                                 mode='sync')
+        self.assertEqual(5, counts['unchanged'])
+
+    def test_read_django_chunksize(self):
+        frames = list(plp.read_django(MyModelWithDates.objects.order_by('id'),
+                                      columns=['foobar'], chunksize=2))
+        self.assertEqual([2, 2, 1], [len(x) for x in frames])
+        self.assertEqual(list(range(5)),
+                         pd.concat(frames)['foobar'].tolist())
+
+
+class PLPWorkersTest(TransactionTestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'name1': ['name%d' % x for x in range(30)],
+            'name2': 'x',
+            'foobar': range(30),
+        })
+
+    def test_workers(self):
+        objs = self.df.to_django(MyModel, workers=3, return_objects=True)
+        self.assertEqual(list(range(30)), [x.foobar for x in objs])
+        self.assertEqual(30, MyModel.objects.count())
+
+    def test_workers_errors(self):
+        # clashes with a row in the second partition.
+        MyModel.objects.create(name1='name15', name2='x', foobar=-1)
+        with self.assertRaises(plp.PandasLovesPoniesException) as cm:
+            self.df.to_django(MyModel, workers=3)
+        self.assertEqual([1], [i for i, _ in cm.exception.errors])
+        self.assertIn('partition 1 (rows 10 to 19)', str(cm.exception))
+        # the other partitions were committed.
+        self.assertEqual(21, MyModel.objects.count())
+
+        self.assertRaises(plp.PandasLovesPoniesException,
+                          self.df.to_django, MyModel, workers=3, atomic='all')
+
+    def test_workers_stats(self):
+        # gathered up from the worker processes.
+        stats = plp.LoadStats()
+        self.df.to_django(MyModel, workers=3, stats=stats)
+        self.assertEqual(30, stats.rows)
+        self.assertEqual(3, stats.chunks)
+        self.assertTrue(stats.queries)
+
+    def test_workers_in_transaction(self):
+        # can't fork with a transaction open, so written from threads.
+        with mock.patch('multiprocessing.get_context') as get_context:
+            with transaction.atomic():
+                self.df.to_django(MyModel, workers=3)
+        get_context.assert_not_called()
+        self.assertEqual(30, MyModel.objects.count())
+
+
+class PLPAtomicTest(TransactionTestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'name1': ['name%d' % x for x in range(10)],
+            'name2': 'x',
+            'foobar': range(10),
+        })
+        # clashes with a row in the third chunk (of 3 rows).
+        MyModel.objects.create(name1='name7', name2='x', foobar=-1)
+
+    def test_atomic_chunk(self):
+        self.assertRaises(IntegrityError, self.df.to_django, MyModel,
+                          force_save=True, commit_every=3)
+        # first two chunks committed, the failed one rolled back.
+        self.assertEqual(7, MyModel.objects.count())
+
+    def test_atomic_all(self):
+        self.assertRaises(IntegrityError, self.df.to_django, MyModel,
+                          force_save=True, atomic='all')
+        self.assertEqual(1, MyModel.objects.count())
+
+    def test_atomic_none(self):
+        self.assertRaises(IntegrityError, self.df.to_django, MyModel,
+                          force_save=True, atomic=None)
+        # each save() was committed as it went.
+        self.assertEqual(8, MyModel.objects.count())
+
+    def test_checkpoint_rolled_back(self):
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'load.json')
+        df = pd.DataFrame({'sku': list('abcd')})
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                df.to_django(Product, commit_every=2, checkpoint=checkpoint,
+                             load_id='products')
+                raise ValueError('roll back')
+        self.assertEqual(0, Product.objects.count())
+        # nothing was committed, so nothing is skipped.
+        df.to_django(Product, commit_every=2, checkpoint=checkpoint,
+                     load_id='products')
+        self.assertEqual(4, Product.objects.count())
+
+    def test_retries(self):
+        calls = []
+        original = plp.core._write_frame
+
+        def flaky_write_frame(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise OperationalError('database is locked')
+            return original(*args, **kwargs)
+
+        plp.core._write_frame = flaky_write_frame
+        try:
+            self.df.iloc[:6].to_django(MyModel, commit_every=3, retries=1)
+        finally:
+            plp.core._write_frame = original
+        self.assertEqual(3, len(calls))
+        self.assertEqual(7, MyModel.objects.count())
@@ -44,6 +44,8 @@ USE_L10N = True
 USE_TZ = True
 USE_TZ = False
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
 # Absolute filesystem path to the directory that will hold user-uploaded files.
 # Example: "/home/media/media.lawrence.com/media/"
 MEDIA_ROOT = ''
@@ -88,7 +90,7 @@ TEMPLATE_LOADERS = (
 #     'django.template.loaders.eggs.Loader',
 )
 
-MIDDLEWARE_CLASSES = (
+MIDDLEWARE = (
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,10 +100,10 @@ MIDDLEWARE_CLASSES = (
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
-ROOT_URLCONF = 'pp.urls'
+ROOT_URLCONF = 'plp.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
-WSGI_APPLICATION = 'pp.wsgi.application'
+WSGI_APPLICATION = 'plp.wsgi.application'
 
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
@@ -159,13 +161,16 @@ LOGGING = {
 
 
 
-from django.conf import settings
 import sys
-if 'test' in sys.argv:
+if 'test' in sys.argv or 'plp_benchmark' in sys.argv:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': 'test_sqlite.db'
+            'NAME': 'test_sqlite.db',
+            # file-backed, so threads writing with their own connections
+            # see the same database.
+            'TEST': {'NAME': 'test_sqlite_test.db'},
+            'OPTIONS': {'timeout': 30},
         }
     }
-    INSTALLED_APPS = [x for x in settings.INSTALLED_APPS if x != 'south']
+    INSTALLED_APPS = [x for x in INSTALLED_APPS if x != 'south']